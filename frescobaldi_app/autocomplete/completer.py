@@ -25,9 +25,11 @@ from __future__ import unicode_literals
 
 import re
 
-from PyQt4.QtGui import QTextCursor
+from PyQt4.QtCore import Qt
+from PyQt4.QtGui import QCompleter, QTextCursor
 
 import app
+import prefixmodel
 import textformats
 import widgets.completer
 
@@ -58,6 +60,26 @@ class Completer(widgets.completer.Completer):
         cursor.setPosition(self._pos, QTextCursor.KeepAnchor)
         return cursor
 
+    def setCompletionPrefix(self, prefix):
+        """Reimplemented to let a PrefixModel filter and rank the completions."""
+        model = self.model()
+        if isinstance(model, prefixmodel.PrefixModel):
+            model.setPrefix(prefix)
+            mode = QCompleter.UnfilteredPopupCompletion
+        else:
+            mode = QCompleter.PopupCompletion
+        if self.completionMode() != mode:
+            self.setCompletionMode(mode)
+        super(Completer, self).setCompletionPrefix(prefix)
+    
+    def insertCompletion(self, index):
+        """Reimplemented to remember the chosen completion for ranking."""
+        text = self.completionModel().data(index, Qt.EditRole)
+        if text:
+            from . import documentdata
+            documentdata.history().addString(text)
+        super(Completer, self).insertCompletion(index)
+    
     def analyzer(self):
         from . import analyzer
         return analyzer.Analyzer()
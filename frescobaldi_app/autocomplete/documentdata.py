@@ -26,8 +26,10 @@ from __future__ import unicode_literals
 import itertools
 import os
 
+import completionmodel
 import listmodel
 import plugin
+import prefixmodel
 import ly.words
 import ly.data
 
@@ -41,78 +43,104 @@ def doc(document):
     return DocumentDataSource.instance(document)
 
 
+def history():
+    """Returns the completionmodel.Model remembering the chosen completions."""
+    return completionmodel.model("autocomplete/history")
+
+
+_sources = {}
+
+def static(name, words):
+    """Returns a SortedStrings with the words, created once for the name."""
+    try:
+        return _sources[name]
+    except KeyError:
+        result = _sources[name] = prefixmodel.SortedStrings(words)
+        return result
+
+
+def model(*sources):
+    """Returns a PrefixModel for the sources, ranked by the history."""
+    return prefixmodel.PrefixModel(sources, rank=history().count)
+
+
+def commands(*iterables):
+    """Returns a SortedStrings with the words prefixed with a backslash."""
+    return prefixmodel.SortedStrings(util.make_cmds(itertools.chain(*iterables)))
+
+
 class DocumentDataSource(plugin.DocumentPlugin):
-    @util.keep
     def words(self):
         """Returns the list of words in comments, markup etc."""
-        return listmodel.ListModel(
-            sorted(set(harvest.words(self.document()))))
+        return model(harvest.words(self.document()))
 
-    @util.keep
     def schemewords(self):
         """Scheme names, including those harvested from document."""
-        schemewords = set(itertools.chain(
-            ly.data.all_scheme_words(),
-            (unicode(t)
-                for t in harvest.schemewords(self.document())
-                if len(t) > 2),
-            ))
-        return listmodel.ListModel(sorted(schemewords))
+        return model(
+            static('scheme', ly.data.all_scheme_words()),
+            harvest.schemewords(self.document()))
 
     @util.keep
     def markup(self, cursor):
         """Completes markup commands and normal text from the document."""
-        return listmodel.ListModel(
-            ['\\' + w for w in sorted(ly.words.markupcommands)]
-            + [ '\\' + w for w in sorted(set(itertools.chain(
+        return model(
+            static('markup', util.make_cmds(ly.words.markupcommands)),
+            commands(
                 harvest.markup_commands(cursor),
-                harvest.include_markup_commands(cursor))))]
-            + sorted(set(harvest.words(self.document()))))
+                harvest.include_markup_commands(cursor)),
+            harvest.words(self.document()))
 
     @util.keep
     def scorecommands(self, cursor):
         """Stuff inside \\score { }. """
-        return listmodel.ListModel(sorted(set(itertools.chain(
-            completiondata.score,
-            harvest.include_identifiers(cursor),
-            harvest.names(cursor)))), display = util.command)
+        return model(
+            static('score', util.make_cmds(completiondata.score)),
+            commands(
+                harvest.include_identifiers(cursor),
+                harvest.names(cursor)))
     
     @util.keep
     def bookpartcommands(self, cursor):
         """Stuff inside \\bookpart { }. """
-        return listmodel.ListModel(sorted(set(itertools.chain(
-            completiondata.bookpart,
-            harvest.include_identifiers(cursor),
-            harvest.names(cursor)))), display = util.command)
+        return model(
+            static('bookpart', util.make_cmds(completiondata.bookpart)),
+            commands(
+                harvest.include_identifiers(cursor),
+                harvest.names(cursor)))
     
     @util.keep
     def bookcommands(self, cursor):
         """Stuff inside \\book { }. """
-        return listmodel.ListModel(sorted(set(itertools.chain(
-            completiondata.book,
-            harvest.include_identifiers(cursor),
-            harvest.names(cursor)))), display = util.command)
+        return model(
+            static('book', util.make_cmds(completiondata.book)),
+            commands(
+                harvest.include_identifiers(cursor),
+                harvest.names(cursor)))
     
     
     @util.keep
     def musiccommands(self, cursor):
-        return listmodel.ListModel(sorted(set(itertools.chain(
-            ly.words.lilypond_keywords,
-            ly.words.lilypond_music_commands,
-            ly.words.articulations,
-            ly.words.ornaments,
-            ly.words.fermatas,
-            ly.words.instrument_scripts,
-            ly.words.repeat_scripts,
-            harvest.include_identifiers(cursor),
-            harvest.names(cursor)))), display = util.command)
+        return model(
+            static('music', util.make_cmds(itertools.chain(
+                ly.words.lilypond_keywords,
+                ly.words.lilypond_music_commands,
+                ly.words.articulations,
+                ly.words.ornaments,
+                ly.words.fermatas,
+                ly.words.instrument_scripts,
+                ly.words.repeat_scripts))),
+            commands(
+                harvest.include_identifiers(cursor),
+                harvest.names(cursor)))
 
     @util.keep
     def lyriccommands(self, cursor):
-        return listmodel.ListModel(sorted(set(itertools.chain(
-            ('set stanza = ', 'set', 'override', 'markup', 'notemode'),
-            harvest.include_identifiers(cursor),
-            harvest.names(cursor)))), display = util.command)
+        return model(
+            static('lyric', util.make_cmds(
+                ('set stanza = ', 'set', 'override', 'markup', 'notemode'))),
+            commands(
+                harvest.include_identifiers(cursor),
+                harvest.names(cursor)))
 
     def includenames(self, cursor, directory=None):
         """Finds files relative to the directory of the cursor's document.
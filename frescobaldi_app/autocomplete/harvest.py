@@ -19,56 +19,38 @@
 
 """
 Harvest strings from document for autocompletion purposes.
+
+The symbols in the document itself are found using the SymbolIndex.
 """
 
 from __future__ import unicode_literals
 
 import itertools
-import re
 
 import documentinfo
 import fileinfo
-import tokeniter
-import ly.lex.lilypond
-import ly.lex.scheme
-
 
-def tokens(cursor):
-    """Yield the tokens tuple for every block from the beginning of the document until the cursor."""
-    end = cursor.block()
-    block = cursor.document().firstBlock()
-    while block < end:
-        yield tokeniter.tokens(block)
-        block = block.next()
+from . import symbolindex
 
 
 def names(cursor):
     """Harvests names from assignments until the cursor."""
-    end = cursor.block()
-    block = cursor.document().firstBlock()
-    while block.isValid() and block != end:
-        for t in tokeniter.tokens(block)[:2]:
-            if type(t) is ly.lex.lilypond.Name:
-                yield t
-                break
-        block = block.next()
+    return symbolindex.index(cursor.document()).names(cursor.block())
 
 
 def markup_commands(cursor):
     """Harvest markup command definitions until the cursor."""
-    return ly.parse.markup_commands(itertools.chain.from_iterable(tokens(cursor)))
+    return symbolindex.index(cursor.document()).markup_commands(cursor.block())
 
     
 def schemewords(document):
-    """Harvests all schemewords from the document."""
-    for t in tokeniter.all_tokens(document):
-        if type(t) is ly.lex.scheme.Word:
-            yield t
+    """Harvests all schemewords (longer than two characters) from the document."""
+    return symbolindex.index(document).schemewords()
 
 
 def include_identifiers(cursor):
     """Harvests identifier definitions from included files."""
-    includeargs = ly.parse.includeargs(itertools.chain.from_iterable(tokens(cursor)))
+    includeargs = symbolindex.index(cursor.document()).includeargs(cursor.block())
     dinfo = documentinfo.info(cursor.document())
     fname = cursor.document().url().toLocalFile()
     files = fileinfo.includefiles(fname, dinfo.includepath(), includeargs)
@@ -78,7 +60,7 @@ def include_identifiers(cursor):
 
 def include_markup_commands(cursor):
     """Harvest markup command definitions from included files."""
-    includeargs = ly.parse.includeargs(itertools.chain.from_iterable(tokens(cursor)))
+    includeargs = symbolindex.index(cursor.document()).includeargs(cursor.block())
     dinfo = documentinfo.info(cursor.document())
     fname = cursor.document().url().toLocalFile()
     files = fileinfo.includefiles(fname, dinfo.includepath(), includeargs)
@@ -86,15 +68,7 @@ def include_markup_commands(cursor):
                                          for f in files)
     
 
-_words = re.compile(r'\w{5,}|\w{2,}(?:[:-]\w+)+').finditer
-_word_types = (
-    ly.lex.String, ly.lex.Comment, ly.lex.Unparsed,
-    ly.lex.lilypond.MarkupWord, ly.lex.lilypond.LyricText)
-
 def words(document):
     """Harvests words from strings, lyrics, markup and comments."""
-    for t in tokeniter.all_tokens(document):
-        if isinstance(t, _word_types):
-            for m in _words(t):
-                yield m.group()
+    return symbolindex.index(document).words()
 
@@ -0,0 +1,239 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2011 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+An index of the symbols in a document, for autocompletion purposes.
+
+For every block the index keeps the names that are assigned to, the markup
+commands that are defined, the arguments of \\include commands, the scheme
+words and the words in strings, comments, markup and lyrics.
+
+The index is updated incrementally: when the document changes, only the
+changed blocks and the blocks the highlighter has re-tokenized are harvested
+again, the next time the index is used.
+
+The scheme words and words of the whole document are kept in SortedStrings,
+so a PrefixModel can complete them directly.
+
+Constructs that span more than one line (e.g. an \\include command with its
+argument on the next line) are found in the block where they end: the state
+of an unfinished construct at the end of every block is kept, and when it
+changes, the next block is harvested again.
+
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+import collections
+import heapq
+import itertools
+import re
+
+import highlighter
+import plugin
+import prefixmodel
+import tokeniter
+import ly.lex.lilypond
+import ly.lex.scheme
+import ly.parse
+
+
+def index(document):
+    """Returns the SymbolIndex for the document."""
+    return SymbolIndex.instance(document)
+
+
+Symbols = collections.namedtuple('Symbols',
+    'names markup_commands includeargs schemewords words')
+
+_empty = Symbols((), (), (), (), ())
+
+_unknown = object()     # the state at the end of a block that is not harvested yet
+
+_words = re.compile(r'\w{5,}|\w{2,}(?:[:-]\w+)+').finditer
+_word_types = (
+    ly.lex.String, ly.lex.Comment, ly.lex.Unparsed,
+    ly.lex.lilypond.MarkupWord, ly.lex.lilypond.LyricText)
+
+
+def harvest(tokens, state=None):
+    """Returns a (Symbols, state) tuple for the tokens of a block.
+    
+    The state is that of an unfinished \\include command or markup command
+    definition at the end of the block, see ly.parse.definitions(). Give the
+    state of the previous block to complete such constructs.
+    
+    """
+    names = ()
+    for t in tokens[:2]:
+        if type(t) is ly.lex.lilypond.Name:
+            names = (unicode(t),)
+            break
+    includeargs, markup_commands, state = ly.parse.definitions(tokens, state)
+    symbols = Symbols(
+        names,
+        tuple(markup_commands),
+        tuple(includeargs),
+        tuple(unicode(t) for t in tokens
+                         if type(t) is ly.lex.scheme.Word and len(t) > 2),
+        tuple(m.group() for t in tokens if isinstance(t, _word_types)
+                        for m in _words(t)))
+    return (symbols if any(symbols) else _empty), state
+
+
+class SymbolIndex(plugin.DocumentPlugin):
+    """Keeps the symbols of every block of a Document.
+
+    The names, markup command definitions and include arguments are found
+    for the blocks before a certain block, using a sorted list of the numbers
+    of the blocks that have them. The scheme words (longer than two
+    characters) and the other words of the whole document are kept in
+    SortedStrings, counting their occurrences.
+
+    """
+    def __init__(self, document):
+        highlighter.highlighter(document).tokensChanged.connect(self._tokensChanged)
+        document.contentsChange.connect(self._contentsChange)
+        count = document.blockCount()
+        self._symbols = [_empty] * count
+        self._states = [_unknown] * count   # states at the end of the blocks
+        self._dirty = set(range(count))
+        self._incoming = []     # blocks re-tokenized before _contentsChange was called
+        self._defs = []         # numbers of blocks with names, markup commands or includes
+        self._schemewords = prefixmodel.SortedStrings()
+        self._words = prefixmodel.SortedStrings()
+
+    def names(self, block):
+        """Yields the names that are assigned to in the blocks before the block."""
+        return self._defined(block, 'names')
+
+    def markup_commands(self, block):
+        """Yields the markup commands defined in the blocks before the block."""
+        return self._defined(block, 'markup_commands')
+
+    def includeargs(self, block):
+        """Yields the arguments of the \\include commands before the block."""
+        return self._defined(block, 'includeargs')
+
+    def schemewords(self):
+        """Returns the SortedStrings with the scheme words in the document."""
+        self._update()
+        return self._schemewords
+
+    def words(self):
+        """Returns the SortedStrings with the words in strings, lyrics, etc."""
+        self._update()
+        return self._words
+
+    def _defined(self, block, field):
+        """(Internal) Yields the field of the Symbols of the blocks before the block."""
+        self._update()
+        end = bisect.bisect_left(self._defs, block.blockNumber())
+        return itertools.chain.from_iterable(
+            getattr(self._symbols[num], field) for num in self._defs[:end])
+
+    def _tokensChanged(self, block):
+        """(Internal) Called by the highlighter when a block is (re)tokenized."""
+        if self.document().blockCount() == len(self._symbols):
+            self._dirty.add(block.blockNumber())
+        else:
+            # the block numbers are already those after the pending change
+            self._incoming.append(block.blockNumber())
+
+    def _contentsChange(self, position, removed, added):
+        """(Internal) Called when the document changes.
+
+        Replaces the Symbols of the changed blocks and renumbers the blocks
+        after them.
+
+        """
+        document = self.document()
+        first = document.findBlock(position).blockNumber()
+        last = document.findBlock(position + added)
+        if not last.isValid():
+            last = document.lastBlock()
+        new = last.blockNumber() - first + 1
+        old = len(self._symbols) - document.blockCount() + new
+        for symbols in self._symbols[first:first+old]:
+            self._remove(symbols)
+        self._symbols[first:first+old] = [_empty] * new
+        self._states[first:first+old] = [_unknown] * new
+        shift = new - old
+        end = first + old
+        start = bisect.bisect_left(self._defs, first)
+        self._defs[start:] = [num + shift
+            for num in self._defs[start:] if num >= end]
+        self._dirty = set(num + shift if num >= end else num
+            for num in self._dirty if not first <= num < end)
+        self._dirty.update(range(first, first + new))
+        self._dirty.update(self._incoming)
+        del self._incoming[:]
+
+    def _update(self):
+        """(Internal) Harvests the symbols of the changed blocks.
+        
+        When the state at the end of a block changes, the next block is
+        harvested as well.
+        
+        """
+        document = self.document()
+        while self._dirty:
+            dirty = sorted(self._dirty)     # a sorted list is a valid heap
+            queued, self._dirty = self._dirty, set()
+            while dirty:
+                num = heapq.heappop(dirty)
+                block = document.findBlockByNumber(num)
+                if not block.isValid():
+                    continue
+                state = self._states[num - 1] if num else None
+                symbols, state = harvest(tokeniter.tokens(block),
+                                         None if state is _unknown else state)
+                self._set(num, symbols)
+                if state != self._states[num]:
+                    self._states[num] = state
+                    if num + 1 < len(self._symbols) and num + 1 not in queued:
+                        queued.add(num + 1)
+                        heapq.heappush(dirty, num + 1)
+
+    def _set(self, num, symbols):
+        """(Internal) Sets the Symbols for the block number."""
+        old = self._symbols[num]
+        if symbols == old:
+            return
+        self._remove(old)
+        self._symbols[num] = symbols
+        for word in symbols.schemewords:
+            self._schemewords.add(word)
+        for word in symbols.words:
+            self._words.add(word)
+        i = bisect.bisect_left(self._defs, num)
+        found = i < len(self._defs) and self._defs[i] == num
+        if symbols.names or symbols.markup_commands or symbols.includeargs:
+            if not found:
+                self._defs.insert(i, num)
+        elif found:
+            del self._defs[i]
+
+    def _remove(self, symbols):
+        """(Internal) Forgets the scheme words and words of the Symbols."""
+        for word in symbols.schemewords:
+            self._schemewords.remove(word)
+        for word in symbols.words:
+            self._words.remove(word)
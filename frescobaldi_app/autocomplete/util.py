@@ -27,23 +27,32 @@ import functools
 import time
 import weakref
 
+from PyQt4.QtGui import QTextCursor
+
 
 def keep(f):
-    """Returns a decorator that remembers its return value for some time."""
+    """Returns a decorator that remembers its return value for some time.
+    
+    A cursor argument is remembered by the number of its block, so the
+    value is computed again when the cursor is in another block.
+    
+    """
     _delay = 5.0 # sec
     _cache = weakref.WeakKeyDictionary()
     @functools.wraps(f)
     def decorator(self, *args):
+        key = tuple(a.blockNumber() if isinstance(a, QTextCursor) else a
+                    for a in args)
         try:
             result = _cache[self]
         except KeyError:
             pass
         else:
-            t, ret = result
-            if (time.time() - t) < _delay:
+            t, k, ret = result
+            if k == key and (time.time() - t) < _delay:
                 return ret
         ret = f(self, *args)
-        _cache[self] = (time.time(), ret)
+        _cache[self] = (time.time(), key, ret)
         return ret
     return decorator
 
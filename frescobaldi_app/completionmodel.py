@@ -51,11 +51,15 @@ class Model(QStringListModel):
     Instantiate the model with a QSettings key, e.g. 'somegroup/names'.
     Use the addString() method to add a string.
     
+    The model also remembers how many times every string was added, which
+    can be used to rank completions (see the count() method).
+    
     """
     def __init__(self, key):
         super(Model, self).__init__()
         self.key = key
         self._changed = False
+        self._counts = {}
         self.load()
         
     def load(self):
@@ -63,12 +67,22 @@ class Model(QStringListModel):
             strings = QSettings().value(self.key, [], type(""))
         except TypeError:
             strings = []
+        try:
+            counts = QSettings().value(self.key + "_counts", [], int)
+        except TypeError:
+            counts = []
+        if len(counts) != len(strings):
+            counts = [1] * len(strings)
+        self._counts = dict(zip(strings, counts))
         self.setStringList(sorted(strings))
         self._changed = False
     
     def save(self):
         if self._changed:
-            QSettings().setValue(self.key, self.stringList())
+            strings = self.stringList()
+            QSettings().setValue(self.key, strings)
+            QSettings().setValue(self.key + "_counts",
+                [self._counts.get(s, 1) for s in strings])
             self._changed = False
 
     def addString(self, text):
@@ -77,6 +91,11 @@ class Model(QStringListModel):
             strings.append(text)
             strings.sort()
             self.setStringList(strings)
-            self._changed = True
+        self._counts[text] = self._counts.get(text, 0) + 1
+        self._changed = True
+
+    def count(self, text):
+        """Returns how many times the text was added, 0 if never."""
+        return self._counts.get(text, 0)
 
 
@@ -29,8 +29,10 @@ from PyQt4.QtGui import QAction, QApplication, QKeySequence
 import app
 import actioncollection
 import actioncollectionmanager
+import documentinfo
 import jobmanager
 import jobattributes
+import jobqueue
 import plugin
 import icons
 import signals
@@ -52,10 +54,15 @@ class Engraver(plugin.MainWindowPlugin):
         ac.engrave_preview.triggered.connect(self.engravePreview)
         ac.engrave_publish.triggered.connect(self.engravePublish)
         ac.engrave_custom.triggered.connect(self.engraveCustom)
+        ac.engrave_all.triggered.connect(self.engraveAll)
+        ac.engrave_autocompile.toggled.connect(self.slotAutoCompileToggled)
         ac.engrave_abort.triggered.connect(self.engraveAbort)
+        ac.engrave_abort_all.triggered.connect(self.engraveAbortAll)
         mainwindow.currentDocumentChanged.connect(self.updateActions)
         app.jobStarted.connect(self.updateActions)
         app.jobFinished.connect(self.updateActions)
+        jobqueue.queue().started.connect(self.updateActions)
+        jobqueue.queue().finished.connect(self.updateActions)
         app.sessionChanged.connect(self.slotSessionChanged)
         app.saveSessionData.connect(self.slotSaveSessionData)
         app.languageChanged.connect(self.updateStickyActionText)
@@ -74,6 +81,8 @@ class Engraver(plugin.MainWindowPlugin):
         ac.engrave_preview.setEnabled(not running)
         ac.engrave_publish.setEnabled(not running)
         ac.engrave_abort.setEnabled(running)
+        queue = jobqueue.queue()
+        ac.engrave_abort_all.setEnabled(bool(queue.runningJobs() or queue.waitingCount()))
         ac.engrave_runner.setIcon(icons.get('process-stop' if running else 'lilypond-run'))
     
     def engraveRunner(self):
@@ -108,6 +117,32 @@ class Engraver(plugin.MainWindowPlugin):
             self.saveDocumentIfDesired()
             self.runJob(dlg.getJob(doc), doc)
     
+    def slotAutoCompileToggled(self, enabled):
+        """Called when the user toggles the 'Automatic Engrave' action."""
+        from . import autocompile
+        autocompile.autocompiler(self.mainwindow()).setEnabled(enabled)
+    
+    def engraveAll(self):
+        """Engraves all documents in preview mode, using the global JobQueue.
+        
+        The current document is engraved first, and documents that share the
+        same master file are engraved only once. Every document is saved first
+        if that is desired.
+        
+        """
+        from . import command
+        current = self.stickyDocument() or self.mainwindow().currentDocument()
+        for doc in app.documents:
+            if doc is not current and not doc.url().toLocalFile():
+                continue
+            self.saveDocumentIfDesired(doc)
+            dinfo = documentinfo.info(doc)
+            key = dinfo.master() or doc.url().toLocalFile() or doc
+            job = command.defaultJob(doc, True)
+            jobattributes.get(job).mainwindow = self.mainwindow()
+            jobqueue.queue().add(job, doc, key, 1 if doc is current else 0)
+        self.updateActions()
+    
     def engrave(self, preview, document=None, may_save=True):
         """Starts a default engraving job.
         
@@ -127,18 +162,28 @@ class Engraver(plugin.MainWindowPlugin):
         self.runJob(command.defaultJob(doc, preview), doc)
     
     def engraveAbort(self):
+        """Aborts the running job and removes the queued jobs of the document."""
+        doc = self.stickyDocument() or self.mainwindow().currentDocument()
+        jobqueue.queue().cancelDocument(doc)
         job = self.runningJob()
         if job:
             job.abort()
+        self.updateActions()
+    
+    def engraveAbortAll(self):
+        """Removes all queued jobs and aborts the running ones."""
+        jobqueue.queue().cancelAll()
+        self.updateActions()
     
-    def saveDocumentIfDesired(self):
-        """Saves the current document if desired and it makes sense.
+    def saveDocumentIfDesired(self, document=None):
+        """Saves the document if desired and it makes sense.
         
         (i.e. the document is modified and has a local filename)
+        If document is not specified, the current document is saved.
         
         """
         if QSettings().value("lilypond_settings/save_on_run", False, bool):
-            doc = self.mainwindow().currentDocument()
+            doc = document or self.mainwindow().currentDocument()
             if doc.isModified() and doc.url().toLocalFile():
                 doc.save()
     
@@ -219,7 +264,11 @@ class Actions(actioncollection.ActionCollection):
         self.engrave_preview = QAction(parent)
         self.engrave_publish = QAction(parent)
         self.engrave_custom = QAction(parent)
+        self.engrave_all = QAction(parent)
+        self.engrave_autocompile = QAction(parent)
+        self.engrave_autocompile.setCheckable(True)
         self.engrave_abort = QAction(parent)
+        self.engrave_abort_all = QAction(parent)
         
         self.engrave_preview.setShortcut(QKeySequence(Qt.CTRL + Qt.Key_M))
         self.engrave_publish.setShortcut(QKeySequence(Qt.CTRL + Qt.SHIFT + Qt.Key_P))
@@ -230,7 +279,9 @@ class Actions(actioncollection.ActionCollection):
         self.engrave_preview.setIcon(icons.get('lilypond-run'))
         self.engrave_publish.setIcon(icons.get('lilypond-run'))
         self.engrave_custom.setIcon(icons.get('lilypond-run'))
+        self.engrave_all.setIcon(icons.get('lilypond-run'))
         self.engrave_abort.setIcon(icons.get('process-stop'))
+        self.engrave_abort_all.setIcon(icons.get('process-stop'))
         
 
     def translateUI(self):
@@ -238,6 +289,9 @@ class Actions(actioncollection.ActionCollection):
         self.engrave_preview.setText(_("&Engrave (preview)"))
         self.engrave_publish.setText(_("Engrave (&publish)"))
         self.engrave_custom.setText(_("Engrave (&custom)..."))
+        self.engrave_all.setText(_("Engrave &All Documents"))
+        self.engrave_autocompile.setText(_("Automatic E&ngrave"))
         self.engrave_abort.setText(_("Abort Engraving &Job"))
+        self.engrave_abort_all.setText(_("Abort All Engra&ving Jobs"))
         
         
@@ -22,16 +22,136 @@ Continuous Auto-compile the sticky or master document.
 
 This is a (mainwindow) global action that can be enabled.
 
-It runs LilyPond in preview mode, always using a temporary file.
-When a document is modified after the last run, LilyPond is run again after
+It runs LilyPond in preview mode, always on a copy of the document text in
+its scratch directory, even if the document sets a master file; the real
+files and their output are never touched.
+When the document is edited after the last run, LilyPond is run again after
 a certain time, if the document looks complete
 (documentinfo.info(doc).looksComplete()).
 
 The log is not displayed.
 
-To be implemented.
+Every edit restarts the timer, and aborts a running auto-compile job for the
+document, as its result would be outdated anyway. So there is never more
+than one pending run. When the text is the same as for the last successful
+run, LilyPond is not run again.
 
 """
 
 from __future__ import unicode_literals
 
+import hashlib
+import os
+import weakref
+
+from PyQt4.QtCore import QTimer
+
+import documentinfo
+import jobattributes
+import jobmanager
+import plugin
+import scratchdir
+from . import engraver
+
+
+def autocompiler(mainwindow):
+    return AutoCompiler.instance(mainwindow)
+
+
+class AutoCompiler(plugin.MainWindowPlugin):
+    
+    # milliseconds to wait after the last edit
+    delay = 1000
+    
+    def __init__(self, mainwindow):
+        self._enabled = False
+        self._document = lambda: None
+        self._job = None
+        self._hashes = weakref.WeakKeyDictionary() # doc: hash of last successful run
+        self._timer = QTimer(singleShot=True, timeout=self.slotTimeout)
+        mainwindow.currentDocumentChanged.connect(self.slotDocumentChanged)
+        engraver(mainwindow).stickyChanged.connect(self.slotDocumentChanged)
+    
+    def setEnabled(self, enabled):
+        """Switches auto-compiling on or off."""
+        if enabled == self._enabled:
+            return
+        self._enabled = enabled
+        if enabled:
+            self.slotDocumentChanged()
+        else:
+            self.setDocument(None)
+            self.abortJob()
+    
+    def isEnabled(self):
+        """Returns True if auto-compiling is enabled."""
+        return self._enabled
+    
+    def document(self):
+        """Returns the document that is watched, if any."""
+        return self._document()
+    
+    def slotDocumentChanged(self):
+        """Called when the current or sticky document changes."""
+        if self._enabled:
+            mainwindow = self.mainwindow()
+            doc = engraver(mainwindow).stickyDocument() or mainwindow.currentDocument()
+            self.setDocument(doc)
+    
+    def setDocument(self, doc):
+        """Starts watching the document (None to stop watching)."""
+        old = self.document()
+        if doc is old:
+            return
+        if old:
+            old.contentsChanged.disconnect(self.slotContentsChanged)
+        self._timer.stop()
+        if doc:
+            self._document = weakref.ref(doc)
+            doc.contentsChanged.connect(self.slotContentsChanged)
+            if doc.isModified():
+                self._timer.start(self.delay)
+        else:
+            self._document = lambda: None
+    
+    def slotContentsChanged(self):
+        """Called on every edit, (re)starts the timer."""
+        self.abortJob()
+        self._timer.start(self.delay)
+    
+    def abortJob(self):
+        """Aborts our job if it is running."""
+        if self._job and self._job.isRunning():
+            self._job.abort()
+    
+    def slotTimeout(self):
+        """Called when the document has not been edited for a while."""
+        doc = self.document()
+        if not doc:
+            return
+        h = hashlib.md5(doc.encodedText()).digest()
+        if h == self._hashes.get(doc):
+            return
+        if jobmanager.isRunning(doc):
+            # try again later (e.g. our aborted job did not yet quit)
+            self._timer.start(self.delay)
+            return
+        dinfo = documentinfo.info(doc)
+        if not dinfo.looksComplete():
+            return
+        scratch = scratchdir.scratchdir(doc)
+        scratch.saveDocument()
+        includepath = []
+        filename = doc.url().toLocalFile()
+        if filename and dinfo.includeargs():
+            includepath.append(os.path.dirname(filename))
+        from . import command
+        job = self._job = command.defaultJob(doc, True, scratch.path(), includepath)
+        attrs = jobattributes.get(job)
+        attrs.mainwindow = self.mainwindow()
+        attrs.hidden = True
+        def done(success, doc=weakref.ref(doc)):
+            if success and doc():
+                self._hashes[doc()] = h
+        job.done.connect(done)
+        jobmanager.manager(doc).startJob(job)
@@ -94,9 +94,17 @@ def preview_options():
    
     return cmd_options
     
-def defaultJob(document, preview):
-    """Returns a default job for the document."""
-    filename, mode, includepath = documentinfo.info(document).jobinfo(True)
+def defaultJob(document, preview, filename=None, includepath=None):
+    """Returns a default job for the document.
+    
+    By default the file to engrave is determined by DocumentInfo.jobinfo(),
+    specify filename (and optionally includepath) to engrave another file.
+    
+    """
+    if filename is None:
+        filename, mode, includepath = documentinfo.info(document).jobinfo(True)
+    else:
+        includepath = list(includepath or [])
     includepath.extend(documentinfo.info(document).includepath())
     i = info(document)
     j = job.Job()
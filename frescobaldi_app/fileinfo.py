@@ -30,16 +30,26 @@ import re
 
 import ly.parse
 import ly.lex
+import app
 import filecache
+import fileinfocache
 import cachedproperty
 import util
 import variables
 
 
 class FileInfo(object):
-    """Caches information about files."""
+    """Caches information about files.
+    
+    The values of the properties listed in persistent are also cached across
+    sessions, see the fileinfocache module.
+    
+    """
     _cache = filecache.FileCache()
     
+    persistent = ('mode', 'includeargs', 'outputargs', 'names',
+                  'markup_commands', 'version')
+    
     @classmethod
     def info(cls, filename):
         filename = os.path.realpath(filename)
@@ -49,10 +59,36 @@ class FileInfo(object):
             info = cls._cache[filename] = cls(filename)
         return info
     
+    @classmethod
+    def store(cls):
+        """Store the information about lexed files in the persistent cache.
+        
+        Only the values that have already been computed are stored, nothing
+        is computed here.
+        
+        """
+        for filename in cls._cache.filenames():
+            info = cls._cache[filename]
+            if info._tokensource is not None:
+                data = {}
+                for name in cls.persistent:
+                    value = getattr(info, name).get()
+                    if value is not None:
+                        data[name] = value
+                fileinfocache.put(filename, data)
+    
     def __init__(self, filename):
         self.filename = filename
         self._tokens = []
         self._tokensource = None
+        data = fileinfocache.get(filename)
+        if data:
+            for name in self.persistent:
+                value = data.get(name)
+                if isinstance(value, list):
+                    value = (tuple(value) if name == 'version' else
+                             [tuple(v) if isinstance(v, list) else v for v in value])
+                setattr(self, name, value)
     
     @cachedproperty.cachedproperty
     def text(self):
@@ -79,6 +115,7 @@ class FileInfo(object):
             return iter(self._tokens)
         elif self._tokensource is None:
             self._tokensource = ly.lex.state(self.mode()).tokens(self.text())
+            fileinfocache.changed()
         return self._token_iterator()
     
     def _token_iterator(self):
@@ -100,6 +137,9 @@ class FileInfo(object):
     def version(self):
         """Returns the LilyPond version if set in the file, as a tuple of ints.
         
+        An empty tuple is returned if the file does not specify a version, so
+        that this is also cached.
+        
         First the function searches inside LilyPond syntax.
         Then it looks at the 'version' document variable.
         Then, if the document is not a LilyPond document, it simply searches for a
@@ -118,6 +158,7 @@ class FileInfo(object):
         m = re.search(r'\\version\s*"(\d+\.\d+(\.\d+)*)"', self.text())
         if m:
             return mkver(m.group(1).split('.'))
+        return ()
 
     @cachedproperty.cachedproperty(depends=mode)
     def includeargs(self):
@@ -177,33 +218,182 @@ def includefiles(filename, include_path=[], initial_args=None):
     
     If the filename is None, only the include_path is searched for files.
     
+    The include relations are cached in the global IncludeGraph, see graph().
+    
+    """
+    return graph().includefiles(filename, include_path, initial_args)
+
+
+def includers(filename):
+    """Returns the set of files known to include the filename, directly or not.
+    
+    Only relations found by earlier calls to includefiles() are known.
+    
+    """
+    return graph().includers(os.path.realpath(filename))
+
+
+def graph():
+    """Returns the global IncludeGraph instance."""
+    global _graph
+    try:
+        return _graph
+    except NameError:
+        _graph = IncludeGraph()
+        return _graph
+
+
+class IncludeGraph(object):
+    """Keeps the include relations between files.
+    
+    For every file the files its include arguments resolve to (the edges) are
+    stored, together with the modification time of the file. The edges are
+    only computed again when the file changes, or, for an open document whose
+    include arguments are given, when those arguments change. The reverse
+    edges are also kept, so it is cheap to find out which files include a
+    certain file.
+    
+    Because include arguments are resolved relative to the directory of the
+    master file and the include path, the edges are stored per context: a
+    (basedir, include_path) tuple.
+    
+    Included files that are deleted are noticed, because the modification
+    time of every file is checked. When a document is saved, its file is
+    invalidated, together with all files that have include arguments that
+    could not be resolved, as the saved file could be the one they refer to.
+    
     """
-    files = set()
-    
-    def tryarg(directory, arg):
-        path = os.path.realpath(os.path.join(directory, arg))
-        if path not in files and os.path.isfile(path):
-            files.add(path)
-            args = FileInfo.info(path).includeargs()
-            find(args, os.path.dirname(path))
-            return True
-            
-    def find(incl_args, directory):
-        for arg in incl_args:
-            # new, recursive, relative include
-            if not (directory and tryarg(directory, arg)):
-                # old include (relative to master file)
-                if not (basedir and tryarg(basedir, arg)):
-                    # if path is given, also search there:
-                    for p in include_path:
-                        if tryarg(p, arg):
-                            break
-    
-    basedir = os.path.dirname(filename) if filename else None
-    if initial_args is None:
-        initial_args = FileInfo.info(filename).includeargs() if filename else ()
-    find(initial_args, basedir)
-    return files
+    def __init__(self):
+        self._edges = {}    # (filename, context): (mtime, args, children, unresolved)
+        self._parents = {}  # filename: set of (filename, context) keys
+    
+    def includefiles(self, filename, include_path=(), initial_args=None):
+        """Returns the set of files included by filename, see includefiles()."""
+        context = (os.path.dirname(filename) if filename else None,
+                   tuple(include_path))
+        files = set()
+        pending = [(filename, initial_args)]
+        while pending:
+            name, args = pending.pop()
+            children = self.children(name, context, args)
+            if children is None:
+                files.discard(name)
+                continue
+            for path in children:
+                if path not in files:
+                    files.add(path)
+                    pending.append((path, None))
+        files.discard(filename)
+        return files
+    
+    def children(self, filename, context, args=None):
+        """Returns the list of files directly included by filename.
+        
+        If args is None, the include arguments are read from the file, and
+        None is returned if the file does not exist (anymore).
+        
+        The resolved files are cached, and only looked up again when the
+        modification time of the file or the given include arguments change,
+        or when the file has been invalidated.
+        
+        """
+        key = (filename, context)
+        mtime = self._mtime(filename) if args is None else None
+        storedargs = None if args is None else list(args)
+        entry = self._edges.get(key)
+        if entry and entry[0] == mtime and entry[1] == storedargs:
+            return entry[2]
+        if entry:
+            self._remove(key)
+        if storedargs is not None:
+            includeargs = storedargs
+        elif mtime is not None:
+            includeargs = FileInfo.info(filename).includeargs()
+        elif filename:
+            return None
+        else:
+            includeargs = ()
+        children = self._resolve(filename, context, includeargs)
+        unresolved = len(children) < len(includeargs)
+        self._edges[key] = (mtime, storedargs, children, unresolved)
+        for path in children:
+            self._parents.setdefault(path, set()).add(key)
+        return children
+    
+    def includers(self, filename):
+        """Returns the set of files that include filename, directly or not."""
+        files = set()
+        pending = [filename]
+        while pending:
+            for name, context in self._parents.get(pending.pop(), ()):
+                if name and name not in files:
+                    files.add(name)
+                    pending.append(name)
+        files.discard(filename)
+        return files
+    
+    def invalidate(self, filename):
+        """Forgets the edges of the file, they will be computed again.
+        
+        The edges of files with include arguments that could not be resolved
+        are also forgotten, as the file may be new.
+        
+        """
+        for key in [key for key, entry in self._edges.items()
+                    if key[0] == filename or entry[3]]:
+            self._remove(key)
+    
+    def clear(self):
+        """Forgets everything."""
+        self._edges.clear()
+        self._parents.clear()
+    
+    def _remove(self, key):
+        """(Internal) Removes the edges stored under the key."""
+        for path in self._edges.pop(key)[2]:
+            keys = self._parents.get(path)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._parents[path]
+    
+    @staticmethod
+    def _resolve(filename, context, includeargs):
+        """(Internal) Returns the list of files the include arguments refer to.
+        
+        Every argument is looked up relative to the directory of the file,
+        the directory of the master file and the include path, in that order.
+        
+        """
+        directory = os.path.dirname(filename) if filename else None
+        basedir, include_path = context
+        children = []
+        for arg in includeargs:
+            for d in (directory, basedir) + include_path:
+                if d:
+                    path = os.path.realpath(os.path.join(d, arg))
+                    if os.path.isfile(path):
+                        children.append(path)
+                        break
+        return children
+    
+    @staticmethod
+    def _mtime(filename):
+        """(Internal) Returns the modification time of filename or None."""
+        if filename:
+            try:
+                return os.path.getmtime(filename)
+            except (IOError, OSError):
+                pass
+
+
+def _documentSaved(document):
+    """(Internal) Invalidates the include relations of a saved document."""
+    filename = document.url().toLocalFile()
+    if filename:
+        graph().invalidate(os.path.realpath(filename))
+
+app.documentSaved.connect(_documentSaved)
 
 
 def basenames(filename, includefiles = None, initial_outputargs = None):
@@ -0,0 +1,129 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Persistently caches information about files across sessions.
+
+The information that fileinfo.FileInfo extracts from a file (include
+arguments, defined names, etc.) is stored in a file in the configuration
+directory, a minute after files have been read and when Frescobaldi quits,
+so that not everything is lost when Frescobaldi does not quit normally. An entry is valid as long as the
+modification time and size of the file and the lexer version have not
+changed, so unchanged files do not need to be read and lexed again.
+
+The number of entries is limited; the least recently used entries are
+dropped first.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import os
+import time
+
+from PyQt4.QtCore import QSettings, QTimer
+
+import app
+import info
+
+
+__all__ = ['get', 'put', 'changed', 'save']
+
+
+# maximum number of files to keep information about
+maxentries = 1000
+
+# change this when the stored data or the lexer output changes
+_format = 1
+
+_entries = None     # filename: [key, access time, data]
+
+
+def _cachefile():
+    """Return the filename of the cache file."""
+    return os.path.join(os.path.dirname(QSettings().fileName()),
+                        "fileinfo-cache.json")
+
+
+def _key(filename):
+    """Return the key a cached entry must match to be valid, or None."""
+    try:
+        s = os.stat(filename)
+    except (IOError, OSError):
+        return
+    return [s.st_mtime, s.st_size, info.version, _format]
+
+
+def _load():
+    """Return the dictionary with entries, loading it if needed."""
+    global _entries
+    if _entries is None:
+        try:
+            with open(_cachefile()) as f:
+                _entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            _entries = {}
+    return _entries
+
+
+def get(filename):
+    """Return the cached data dictionary for the (real) filename, or None."""
+    entries = _load()
+    try:
+        entry = entries[filename]
+    except KeyError:
+        return
+    if entry[0] != _key(filename):
+        del entries[filename]
+        return
+    entry[1] = time.time()
+    return entry[2]
+
+
+def put(filename, data):
+    """Store the data dictionary for the (real) filename."""
+    key = _key(filename)
+    if key:
+        _load()[filename] = [key, time.time(), data]
+
+
+def changed():
+    """Schedule saving the cache, call this when a file is read and lexed."""
+    if not _saveTimer.isActive():
+        _saveTimer.start()
+
+
+def save():
+    """Write the cache to disk, keeping the most recently used entries."""
+    _saveTimer.stop()
+    import fileinfo
+    fileinfo.FileInfo.store()
+    if _entries is None:
+        return
+    newest = sorted(_entries.items(), key=lambda item: item[1][1], reverse=True)
+    try:
+        with open(_cachefile(), 'w') as f:
+            json.dump(dict(newest[:maxentries]), f)
+    except (IOError, OSError):
+        pass
+
+
+_saveTimer = QTimer(singleShot=True, interval=60000, timeout=save)
+app.aboutToQuit.connect(save)
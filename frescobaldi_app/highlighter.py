@@ -24,7 +24,11 @@ about a document's contents.
 
 from __future__ import unicode_literals
 
+import functools
+import threading
+import weakref
 
+from PyQt4.QtCore import pyqtSignal, QPoint, QThread, QTimer
 from PyQt4.QtGui import (
     QSyntaxHighlighter, QTextBlockUserData, QTextCursor, QTextDocument)
 
@@ -40,6 +44,7 @@ import cursortools
 import textformats
 import metainfo
 import plugin
+import signals
 import variables
 import documentinfo
 
@@ -173,8 +178,11 @@ class HighlightFormats(object):
         Returned values are cached to improve the lookup speed.
         
         """
+        return self.classFormat(token.__class__)
+    
+    def classFormat(self, cls):
+        """Return the format defined for the Token class, see format()."""
         d = self._formats
-        cls = token.__class__
         try:
             return d[cls]
         except KeyError:
@@ -201,7 +209,26 @@ class Highlighter(QSyntaxHighlighter, plugin.Plugin):
     The Highlighter automatically re-reads the highlighting settings if they
     are changed.
     
+    The tokensChanged signal is emitted with the block every time the tokens
+    of a block have been stored. The tokens are stored as a compact
+    slexer.TokenStream, from which the formats are applied without creating
+    Token instances; tokeniter.tokens() turns it into a tuple of Tokens when
+    the tokens of a block are needed.
+    
+    When a document with more than backgroundThreshold blocks is highlighted
+    for the first time (e.g. after loading), the text is tokenized in a
+    background thread. The tokens and states are stored in the blocks as they
+    become available, and the formats are applied a batch at a time, the
+    blocks visible in the views of the document first. This keeps the user
+    interface responsive. tokeniter waits for the background thread when it
+    needs tokens of a block that has not been tokenized yet.
+    
     """
+    backgroundThreshold = 5000
+    formatBatch = 200
+    
+    tokensChanged = signals.Signal() # QTextBlock
+    
     def __init__(self, document):
         QSyntaxHighlighter.__init__(self, document)
         self._fridge = ly.lex.Fridge()
@@ -209,6 +236,16 @@ class Highlighter(QSyntaxHighlighter, plugin.Plugin):
         self._initialState = None
         self._highlighting = True
         self._mode = None
+        self._tokenizer = None
+        self._tokenized = 0     # number of the first block not yet tokenized
+        self._lastNum = -1      # state number at the end of the last tokenized line
+        self._pending = {}      # tokenized blocks whose formats are not yet applied
+        self._formatFrom = 0    # number of the first block to look for in _pending
+        self._formatTimer = QTimer(self, singleShot=True, timeout=self._formatPending)
+        self._stopOnDestroy = None
+        self._views = weakref.WeakSet()
+        self._limit = None      # do not highlight new blocks after this number
+        app.aboutToQuit.connect(self._stopTokenizer)
         self.initializeDocument()
     
     def initializeDocument(self):
@@ -225,6 +262,7 @@ class Highlighter(QSyntaxHighlighter, plugin.Plugin):
         if hasattr(document, 'url'):
             self._highlighting = metainfo.info(document).highlighting
             document.loaded.connect(self._resetHighlighting)
+            document.closed.connect(self._stopTokenizer)
             self._mode = documentinfo.mode(document, False)
             variables.manager(document).changed.connect(self._variablesChange)
         
@@ -241,30 +279,199 @@ class Highlighter(QSyntaxHighlighter, plugin.Plugin):
         
     def highlightBlock(self, text):
         """Called by Qt when the highlighting of the current line needs updating."""
-        # find the state of the previous line
+        block = self.currentBlock()
         prev = self.previousBlockState()
+        num = block.blockNumber()
+        if block.userState() == -1 and (
+            (self._limit is not None and num > self._limit)
+            or (self._tokenizer is not None and num >= self._tokenized)
+            or (self._tokenizer is None and self._startBackground(block))):
+            # not yet tokenized in the background, or beyond the block
+            # highlightUpTo() was asked for; leaving the state at -1 makes Qt
+            # stop highlighting the following blocks
+            self.setCurrentBlockState(-1)
+            return
+        data = self._pending.pop(num, None)
+        if data:
+            line, prevNum, tokens, stateNum = data
+            if line == text and prevNum == prev:
+                cursortools.data(block).tokens = tokens
+                self.setCurrentBlockState(stateNum)
+                self._applyFormats(tokens)
+                self.tokensChanged(block)
+                return
+        
+        # find the state of the previous line
         state = self._fridge.thaw(prev)
         blank = not state and (not text or text.isspace())
         if not state:
             state = self.initialState()
 
         # collect and save the tokens
-        tokens = tuple(state.tokens(text))
-        cursortools.data(self.currentBlock()).tokens = tokens
+        tokens = state.tokens(text, compact=True)
+        cursortools.data(block).tokens = tokens
         
         # if blank thus far, keep the highlighter coming back
         # because the parsing state is not yet known; else save the state
         self.setCurrentBlockState(prev - 1 if blank else self._fridge.freeze(state))
-        
-        # apply highlighting if desired
+        self._applyFormats(tokens)
+        self.tokensChanged(block)
+    
+    def _applyFormats(self, stream):
+        """(Internal) Apply the highlighting formats for the TokenStream if desired."""
         if self._highlighting:
-            setFormat = lambda f: self.setFormat(token.pos, len(token), f)
-            formats = highlightFormats()
-            for token in tokens:
-                f = formats.format(token)
+            classFormat = highlightFormats().classFormat
+            for i in range(len(stream)):
+                f = classFormat(stream.cls(i))
                 if f:
-                    setFormat(f)
+                    pos = stream.pos(i)
+                    self.setFormat(pos, stream.end(i) - pos, f)
+        
+    def _startBackground(self, block):
+        """(Internal) Start tokenizing in the background if that is useful.
         
+        This is the case when the first block of a large document is
+        highlighted while the last block has never been highlighted.
+        Returns True if the tokenizer was started.
+        
+        """
+        document = self.document()
+        if (block.blockNumber() > 0
+            or document.blockCount() <= self.backgroundThreshold
+            or document.lastBlock().userState() != -1):
+            return False
+        self._pending.clear()
+        self._formatFrom = 0
+        self._startTokenizer(block)
+        return True
+    
+    def _startTokenizer(self, block):
+        """(Internal) Start tokenizing in the background from the block on.
+        
+        If blocks before the block have not been tokenized either, starts at
+        the first of those.
+        
+        """
+        self._stopTokenizer()
+        while block.previous().isValid() and block.previous().userState() == -1:
+            block = block.previous()
+        start = block.blockNumber()
+        for num in [num for num in self._pending if num >= start]:
+            del self._pending[num]
+        self._tokenized = start
+        self._lastNum = block.previous().userState()
+        document = self.document()
+        lines = []
+        b = block
+        while b.isValid():
+            lines.append(b.text())
+            b = b.next()
+        tokenizer = self._tokenizer = Tokenizer(lines, self.state(block.previous()), start)
+        tokenizer.chunkReady.connect(self._takeResults)
+        tokenizer.finished.connect(self._takeResults)
+        # never let Qt destroy a running thread together with the document
+        self._stopOnDestroy = functools.partial(Tokenizer.stop, tokenizer)
+        document.destroyed.connect(self._stopOnDestroy)
+        tokenizer.start()
+    
+    def _stopTokenizer(self):
+        """(Internal) Stop the background Tokenizer if it is running."""
+        tokenizer, self._tokenizer = self._tokenizer, None
+        if tokenizer:
+            tokenizer.stop()
+            try:
+                self.document().destroyed.disconnect(self._stopOnDestroy)
+            except (AttributeError, RuntimeError, TypeError):
+                pass
+            self._stopOnDestroy = None
+    
+    def _takeResults(self):
+        """(Internal) Store the results of the background Tokenizer in the blocks.
+        
+        The tokens and the states are set directly; the formats are applied
+        later by _formatPending(). If a line has been changed since it was
+        tokenized, the Tokenizer is restarted at that line.
+        
+        """
+        tokenizer = self._tokenizer
+        if tokenizer is None:
+            return
+        done = tokenizer.done()
+        document = self.document()
+        store = self._fridge.store
+        for start, chunk in tokenizer.take():
+            num = start
+            block = document.findBlockByNumber(num)
+            prevNum = self._lastNum
+            for line, tokens, frozen in chunk:
+                if (not block.isValid() or block.text() != line
+                    or block.previous().userState() != prevNum):
+                    if block.isValid():
+                        self._startTokenizer(block)
+                    else:
+                        self._stopTokenizer()
+                    self._formatTimer.start()
+                    return
+                stateNum = store(frozen)
+                cursortools.data(block).tokens = tokens
+                block.setUserState(stateNum)
+                self._pending[num] = (line, prevNum, tokens, stateNum)
+                self.tokensChanged(block)
+                prevNum = stateNum
+                block = block.next()
+                num += 1
+            self._lastNum = prevNum
+            self._tokenized = num
+            self._formatFrom = min(self._formatFrom, start)
+        if done:
+            if self._tokenized < document.blockCount():
+                # lines were added at the end in the meantime
+                self._startTokenizer(document.findBlockByNumber(self._tokenized))
+            else:
+                self._stopTokenizer()
+        if self._pending:
+            self._formatTimer.start()
+    
+    def _formatPending(self):
+        """(Internal) Apply the formats of blocks that were tokenized in the background.
+        
+        The blocks visible in the views are done first, then a batch of
+        formatBatch blocks in document order.
+        
+        """
+        document = self.document()
+        todo = []
+        for view in list(self._views):
+            try:
+                first = view.cursorForPosition(QPoint(0, 0)).block()
+                last = view.cursorForPosition(QPoint(0, view.viewport().height())).block()
+            except RuntimeError:
+                continue # view was deleted
+            todo.extend(num for num in range(first.blockNumber(), last.blockNumber() + 1)
+                        if num in self._pending)
+        num = self._formatFrom
+        while len(todo) < self.formatBatch and num < self._tokenized:
+            if num in self._pending:
+                todo.append(num)
+            num += 1
+        self._formatFrom = num
+        for num in todo:
+            if num in self._pending:
+                self.rehighlightBlock(document.findBlockByNumber(num))
+        if not todo and self._pending:
+            # entries that were skipped, or left behind by changes in the text
+            first = min(self._pending)
+            if first < self._tokenized:
+                self._formatFrom = first
+            else:
+                self._pending.clear()
+        if self._pending:
+            self._formatTimer.start()
+    
+    def addView(self, view):
+        """Add a view showing our document, its visible blocks are formatted first."""
+        self._views.add(view)
+    
     def setHighlighting(self, enable):
         """Enable or disable highlighting."""
         changed = enable != self._highlighting
@@ -286,6 +493,38 @@ class Highlighter(QSyntaxHighlighter, plugin.Plugin):
         """
         return self._fridge.thaw(block.userState()) or self.initialState()
 
+    def highlightUpTo(self, block):
+        """Make sure the highlighter has run up to and including the block.
+        
+        If the document is being tokenized in the background, waits until
+        the Tokenizer has reached the block and uses its results.
+        
+        Otherwise, only the blocks that have never been highlighted are
+        processed, starting at the first of those before the block. Blocks
+        after the block that have never been highlighted are left alone, so
+        Qt stops there instead of highlighting the rest of the document.
+        Blocks that were highlighted before are updated by Qt as long as their
+        state changes.
+        
+        """
+        num = block.blockNumber()
+        if self._tokenizer is None:
+            first = block
+            while first.previous().isValid() and first.previous().userState() == -1:
+                first = first.previous()
+            end = block.next()
+            self._limit = num
+            try:
+                while first.isValid() and first != end and self._tokenizer is None:
+                    if first.userState() == -1:
+                        self.rehighlightBlock(first)
+                    first = first.next()
+            finally:
+                self._limit = None
+        while self._tokenizer is not None and self._tokenized <= num:
+            self._tokenizer.waitFor(num + 1)
+            self._takeResults()
+
     def setInitialState(self, state):
         """Force the initial state. Use None to enable auto-detection."""
         self._initialState = self._fridge.freeze(state) if state else None
@@ -298,6 +537,80 @@ class Highlighter(QSyntaxHighlighter, plugin.Plugin):
         return self._fridge.thaw(self._initialState)
 
 
+class Tokenizer(QThread):
+    """Tokenizes lines of text in a background thread.
+    
+    The results are collected in chunks of chunkSize lines. Every chunk is a
+    (start, list) tuple, where start is the number of the first line and the
+    list contains a (text, TokenStream, frozen state) tuple for every line.
+    The chunkReady signal is emitted after every chunk; take() returns the
+    chunks that are ready.
+    
+    """
+    chunkReady = pyqtSignal()
+    chunkSize = 500
+    
+    def __init__(self, lines, state, start=0):
+        QThread.__init__(self)
+        self._lines = lines
+        self._state = state
+        self._start = start
+        self._chunks = []
+        self._count = start     # number of the first line not yet tokenized
+        self._done = False
+        self._stopped = False
+        self._condition = threading.Condition()
+    
+    def run(self):
+        """Main method of this thread, called by Qt on start()."""
+        state = self._state
+        try:
+            for start in range(0, len(self._lines), self.chunkSize):
+                chunk = []
+                for line in self._lines[start:start+self.chunkSize]:
+                    if self._stopped:
+                        return
+                    tokens = state.tokens(line, compact=True)
+                    chunk.append((line, tokens, state.freeze()))
+                with self._condition:
+                    self._chunks.append((self._start + start, chunk))
+                    self._count = self._start + start + len(chunk)
+                    self._condition.notify_all()
+                self.chunkReady.emit()
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+    
+    def stop(self):
+        """Stop tokenizing and wait for the thread to finish."""
+        self._stopped = True
+        self.wait()
+    
+    def done(self):
+        """Return True if all lines have been tokenized (or tokenizing was stopped)."""
+        with self._condition:
+            return self._done
+    
+    def take(self):
+        """Return the chunks that are ready, and forget them."""
+        with self._condition:
+            chunks, self._chunks = self._chunks, []
+        return chunks
+    
+    def waitFor(self, count):
+        """Wait until count lines have been tokenized or the thread has finished."""
+        with self._condition:
+            while self._count < count and not self._done:
+                self._condition.wait()
+
+
+@app.viewCreated.connect
+def _viewCreated(view):
+    """Let the Highlighter of the document know the view."""
+    highlighter(view.document()).addView(view)
+
+
 def htmlCopy(document, type='editor'):
     """Return a new QTextDocument with highlighting set as HTML textcharformats."""
     data = textformats.formatData(type)
@@ -325,11 +638,12 @@ def highlight(document, formats=None, state=None):
     cursor = QTextCursor(document)
     block = document.firstBlock()
     while block.isValid():
-        for token in state.tokens(block.text()):
-            f = formats.format(token)
+        stream = state.tokens(block.text(), compact=True)
+        for i in range(len(stream)):
+            f = formats.classFormat(stream.cls(i))
             if f:
-                cursor.setPosition(block.position() + token.pos)
-                cursor.setPosition(block.position() + token.end, QTextCursor.KeepAnchor)
+                cursor.setPosition(block.position() + stream.pos(i))
+                cursor.setPosition(block.position() + stream.end(i), QTextCursor.KeepAnchor)
                 cursor.setCharFormat(f)
         block = block.next()
 
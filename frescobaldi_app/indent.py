@@ -23,6 +23,8 @@ Indent and auto-indent.
 
 from __future__ import unicode_literals
 
+import itertools
+
 from PyQt4.QtGui import QTextCursor
 
 import ly.lex
@@ -206,20 +208,150 @@ def change_indent(cursor, direction):
 
 
 def re_indent(cursor):
-    """Re-indents the selected region or the whole document."""
+    """Re-indents the selected region or the whole document.
+    
+    The document is read once from the beginning using an Indenter, the lines
+    before the selection are only used to determine the indent levels.
+    
+    """
+    document = cursor.document()
     if cursor.hasSelection():
-        blocks = cursortools.blocks(cursor)
+        start = document.findBlock(cursor.selectionStart())
+        end = document.findBlock(cursor.selectionEnd())
     else:
-        blocks = cursortools.all_blocks(cursor.document())
+        start, end = document.firstBlock(), document.lastBlock()
+    indenter = Indenter(document)
     with cursortools.compress_undo(cursor):
-        for block in blocks:
+        for block in cursortools.forwards(document.firstBlock(), end):
+            change = block >= start
+            indent = indenter.indent(block, change)
+            if change and set_indent(block, indent):
+                tokeniter.update(block) # force token update if changed
+
+
+class Indenter(object):
+    """Computes the indent of all lines of a document in one pass.
+    
+    Call indent() for all blocks from the beginning of the document. The
+    computed indent is the same as compute_indent() would return, but instead
+    of searching backwards for the token that starts the current indent, the
+    Indenter remembers the last Indent token that opened every level, and
+    the last line that was at every level.
+    
+    """
+    def __init__(self, document):
+        self._vars = indent_variables(document)
+        self._depth = 0
+        self._count = 0
+        self._openers = {}  # level: (count, line, index) of the last opening Indent
+        self._lines = {}    # level: (count, line) of the last non-empty line
+    
+    def indent(self, block, change=True):
+        """Returns the indent for the next block.
+        
+        If change is True and the block is in LilyPond or Scheme mode, the
+        computed indent is returned, otherwise the current indent of the block.
+        The following blocks are indented as if the block gets that indent.
+        
+        """
+        text = block.text()
+        tokens = tokeniter.tokens(block)
+        if ''.join(tokens) != text:
+            # the document has been changed in the current edit block
             tokeniter.update(block)
-            if tokeniter.state(block).mode() in ('lilypond', 'scheme'):
-                indent = compute_indent(block)
+            tokens = tokeniter.tokens(block)
+        mode = tokeniter.state(block).mode()
+        self._count += 1
+        
+        # count the dedent tokens at the beginning of the line
+        level = self._depth
+        for token in tokens:
+            # dont dedent scheme dedent tokens at beginning of lines (unusual)
+            if isinstance(token, ly.lex.Dedent) and not isinstance(token, ly.lex.scheme.CloseParen):
+                level -= 1
+            elif not isinstance(token, ly.lex.Space):
+                break
+        
+        # the leading whitespace
+        lead = len(tokens[0]) if tokens and isinstance(tokens[0], ly.lex.Space) else 0
+        if change and mode in ('lilypond', 'scheme'):
+            indent = self._compute(level)
+            space = make_indent(indent, self._vars['tab-width'], self._vars['indent-tabs'])
+            shift = len(space) - lead
+            if space != text[:lead]:
+                text = space + text[lead:]
+                if not lead:
+                    # the new whitespace may be part of another token, e.g. a string
+                    first = next(tokeniter.state(block).tokens(text))
+                    lead = len(first) if isinstance(first, ly.lex.Space) else 0
+                else:
+                    lead = len(space)
+        else:
+            indent = column_position(text, lead, self._vars['tab-width'])
+            shift = 0
+        
+        # remember the line, with the text and the length of the leading
+        # whitespace as they will be after changing the indent
+        line = (tokens, text, lead, shift)
+        for index, token in enumerate(tokens):
+            if isinstance(token, ly.lex.Indent):
+                self._depth += 1
+                self._openers[self._depth] = (self._count, line, index)
+            elif isinstance(token, ly.lex.Dedent):
+                self._depth -= 1
+        if text:
+            self._lines[level] = (self._count, line)
+        return indent
+    
+    def _compute(self, level):
+        """(Internal) Returns the indent for a line at the specified level."""
+        opener = self._openers.get(level)
+        previous = self._lines.get(level)
+        tabwidth = self._vars['tab-width']
+        if opener and (not previous or opener[0] >= previous[0]):
+            count, line, index = opener
+            return self._opener_indent(line, index)
+        elif previous:
+            # take over indent of that line
+            count, (tokens, text, lead, shift) = previous
+            return column_position(text, lead, tabwidth)
+        return 0
+    
+    def _opener_indent(self, line, index):
+        """(Internal) Returns the indent for the first line after an Indent token.
+        
+        The Indent token is at index in the tokens of the line. If there are no tokens after the
+        indent-opener, the indent of its line is increased, else the indent
+        is the same as the position of the token after the indent-opener.
+        
+        """
+        tokens, text, lead, shift = line
+        found = tokens[index]
+        lasttokens = list(itertools.islice((t for t in tokens[index+1:]
+            if not isinstance(t, (ly.lex.Space, ly.lex.Dedent))), 2))
+        indent_add = 0
+        if isinstance(found, ly.lex.scheme.OpenParen):
+            # scheme
+            if lasttokens:
+                if len(lasttokens) == 1 or isinstance(lasttokens[0], ly.lex.Indent):
+                    indent_pos = lasttokens[0].pos + shift
+                elif lasttokens[0] in scheme_sync_args:
+                    indent_pos = lasttokens[1].pos + shift
+                else:
+                    indent_pos = found.pos + shift
+                    indent_add = self._vars['indent-width']
             else:
-                indent = get_indent(block)
-            if set_indent(block, indent):
-                tokeniter.update(block) # force token update if changed
+                indent_pos = found.pos + shift
+                indent_add = 1
+        else:
+            # no scheme (lilypond)
+            if lasttokens:
+                indent_pos = lasttokens[0].pos + shift
+            else:
+                # just use current indent + INDENT_WIDTH
+                indent_pos = lead
+                indent_add = self._vars['indent-width']
+        return column_position(text, indent_pos, self._vars['tab-width']) + indent_add
 
 
 def get_indent(block):
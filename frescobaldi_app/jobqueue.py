@@ -0,0 +1,138 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+A global queue that runs Jobs for many documents, a limited number at a time.
+
+The jobs are started via the JobManager of their document, so the usual
+app-wide jobStarted() and jobFinished() signals are emitted. As a JobManager
+only runs one job at a time, a queued job for a document that is busy waits
+until that document's job has finished.
+
+Every queued job has a key (by default the document); when a job is added
+with the same key as a job that is still waiting, the waiting job is replaced,
+so repeated requests to engrave the same master file run only once.
+
+"""
+
+from __future__ import unicode_literals
+
+import itertools
+
+from PyQt4.QtCore import QThread
+
+import app
+import jobmanager
+import signals
+
+
+def queue():
+    """Returns the global JobQueue instance."""
+    global _queue
+    try:
+        return _queue
+    except NameError:
+        _queue = JobQueue()
+        return _queue
+
+
+class JobQueue(object):
+    """Runs queued Jobs, at most maxRunning() at the same time."""
+
+    started = signals.Signal()  # Job
+    finished = signals.Signal() # Job, success
+
+    def __init__(self, maxrunning=None):
+        self._maxrunning = maxrunning or max(1, QThread.idealThreadCount())
+        self._waiting = []      # list of [priority, count, key, job, document]
+        self._running = {}      # job: key
+        self._counter = itertools.count()
+        app.documentClosed.connect(self.cancelDocument)
+        app.jobFinished.connect(self._jobFinished)
+
+    def maxRunning(self):
+        """Returns the maximum number of jobs running at the same time."""
+        return self._maxrunning
+
+    def setMaxRunning(self, count):
+        """Sets the maximum number of jobs running at the same time."""
+        self._maxrunning = max(1, count)
+        self._startJobs()
+
+    def add(self, job, document, key=None, priority=0):
+        """Queues the job, to be run on behalf of the document.
+
+        If a job with the same key is still waiting, it is replaced by this
+        one, keeping the higher of both priorities. Jobs with a higher priority
+        are started first; jobs with the same priority in the order they were
+        added.
+
+        """
+        if key is None:
+            key = document
+        for item in self._waiting:
+            if item[2] == key:
+                self._waiting.remove(item)
+                priority = max(priority, item[0])
+                break
+        self._waiting.append([priority, next(self._counter), key, job, document])
+        self._startJobs()
+
+    def cancelDocument(self, document):
+        """Removes the waiting jobs for the document."""
+        self._waiting = [item for item in self._waiting if item[4] is not document]
+
+    def cancelAll(self):
+        """Removes all waiting jobs and aborts the running ones."""
+        del self._waiting[:]
+        for job in list(self._running):
+            job.abort()
+
+    def waitingCount(self):
+        """Returns the number of jobs that wait to be started."""
+        return len(self._waiting)
+
+    def runningJobs(self):
+        """Returns the list of jobs that were started by this queue and still run."""
+        return list(self._running)
+
+    def _startJobs(self):
+        """(Internal) Starts waiting jobs while there is room for them."""
+        # highest priority first, then oldest first
+        self._waiting.sort(key=lambda item: (-item[0], item[1]))
+        for item in list(self._waiting):
+            if len(self._running) >= self._maxrunning:
+                break
+            priority, count, key, job, document = item
+            if key in self._running.values():
+                continue
+            manager = jobmanager.manager(document)
+            if manager.isRunning():
+                continue # try again when that job has finished
+            self._waiting.remove(item)
+            self._running[job] = key
+            manager.startJob(job)
+            self.started(job)
+
+    def _jobFinished(self, document, job, success):
+        """(Internal) Called when any job has finished."""
+        if job in self._running:
+            del self._running[job]
+            self.finished(job, success)
+        self._startJobs()
@@ -57,13 +57,18 @@ class LogTool(panel.Panel):
     def slotJobStarted(self, doc, job):
         """Called whenever job starts, decides whether to follow it and show the log."""
         import jobattributes
-        if doc == self.mainwindow().currentDocument() or self.mainwindow() == jobattributes.get(job).mainwindow:
+        attrs = jobattributes.get(job)
+        if attrs.hidden:
+            return
+        if doc == self.mainwindow().currentDocument() or self.mainwindow() == attrs.mainwindow:
             self.widget().switchDocument(doc)
             if QSettings().value("log/show_on_start", True, bool):
                 self.show()
 
     def slotJobFinished(self, document, job, success):
+        import jobattributes
         if (not success and not job.isAborted()
+                and not jobattributes.get(job).hidden
                 and document == self.mainwindow().currentDocument()):
             self.show()
     
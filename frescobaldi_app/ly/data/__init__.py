@@ -19,22 +19,20 @@
 
 """
 Query functions to get data from the LilyPond-generated _data.py module.
+
+Most queries are lookups in indexes that _data.py computes when it is
+imported. The returned lists should not be altered.
 """
 
 def grob_properties(grob):
     """Returns the list of properties the named grob supports."""
     from . import _data
-    return sorted(uniq(prop
-        for iface in _data.grobs.get(grob, [])
-        for prop in _data.interfaces[iface]))
+    return _data.grob_properties.get(grob, [])
 
 def grob_properties_with_interface(grob):
     """Returns a list of two-tuples (property, interface)."""
     from . import _data
-    return sorted(
-        (prop, iface)
-        for iface in _data.grobs.get(grob, [])
-        for prop in _data.interfaces[iface])
+    return _data.grob_properties_with_interface.get(grob, [])
 
 def grob_interfaces(grob, prop=None):
     """Returns the list of interfaces a grob supports.
@@ -46,8 +44,8 @@ def grob_interfaces(grob, prop=None):
     ifaces = _data.grobs.get(grob, [])
     if prop is None:
         return ifaces
-    return [iface for iface in ifaces
-            if prop in grob_interface_properties(iface)]
+    defining = _data.property_interfaces.get(prop, ())
+    return [iface for iface in ifaces if iface in defining]
 
 def grob_interface_properties(iface):
     """Returns the list of properties an interface supports."""
@@ -61,19 +59,22 @@ def grob_interfaces_for_property(prop):
     
     """
     from . import _data
-    return [iface
-        for iface, props in _data.interfaces.items()
-        if prop in props]
+    return _data.property_interfaces.get(prop, [])
+
+def grobs_for_property(prop):
+    """Returns the sorted list of grobs that support the property."""
+    from . import _data
+    return _data.property_grobs.get(prop, [])
 
 def grobs():
     """Returns the sorted list of all grob names."""
     from . import _data
-    return sorted(_data.grobs.keys())
+    return _data.all_grob_names
     
 def all_grob_properties():
     """Returns the list of all properties."""
     from . import _data
-    return sorted(uniq(sum(_data.interfaces.values(), [])))
+    return _data.all_grob_properties
 
 def context_properties():
     """Returns the list of context properties."""
@@ -113,8 +114,7 @@ def scheme_constants():
 def all_scheme_words():
     """Returns the list of all scheme words."""
     from . import _data
-    return _data.scheme_keywords + _data.scheme_functions \
-        + _data.scheme_variables + _data.scheme_constants
+    return _data.all_scheme_words
 
 def uniq(iterable):
     """Returns an iterable, removing duplicates. The items should be hashable."""
@@ -29,3 +29,35 @@ if "bar-extent" not in interfaces["bar-line-interface"]:
     interfaces["bar-line-interface"].insert(1, "bar-extent")
 
 
+# Indexes for the query functions in __init__.py, computed once.
+
+# property: list of interfaces defining it (in the order of interfaces)
+property_interfaces = {}
+for iface, props in interfaces.items():
+    for prop in set(props):
+        property_interfaces.setdefault(prop, []).append(iface)
+
+# grob: sorted list of (property, interface) tuples
+grob_properties_with_interface = dict(
+    (grob, sorted((prop, iface)
+        for iface in ifaces
+        for prop in interfaces[iface]))
+    for grob, ifaces in grobs.items())
+
+# grob: sorted list of properties
+grob_properties = dict(
+    (grob, sorted(set(prop for prop, iface in props)))
+    for grob, props in grob_properties_with_interface.items())
+
+# property: sorted list of grobs supporting it
+property_grobs = {}
+for grob, props in grob_properties.items():
+    for prop in props:
+        property_grobs.setdefault(prop, []).append(grob)
+for names in property_grobs.values():
+    names.sort()
+
+all_grob_names = sorted(grobs)
+all_grob_properties = sorted(property_interfaces)
+all_scheme_words = (scheme_keywords + scheme_functions
+                    + scheme_variables + scheme_constants)
@@ -0,0 +1,84 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2011 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Benchmarks the queries used when completing \\override commands.
+
+Run with: python -m ly.data.benchmark
+
+Every query is timed for all grobs (or properties), once computed from the
+interfaces and grobs tables (as was done before the indexes existed) and once
+as a lookup in the indexes of _data.py. The time it takes to build the indexes
+when _data.py is imported is also shown.
+
+"""
+
+from __future__ import unicode_literals
+
+import timeit
+
+from . import _data
+import ly.data
+
+
+def scan_grob_properties(grob):
+    """Computes grob_properties() from the tables."""
+    return sorted(set(prop
+        for iface in _data.grobs.get(grob, [])
+        for prop in _data.interfaces[iface]))
+
+def scan_grob_interfaces_for_property(prop):
+    """Computes grob_interfaces_for_property() from the tables."""
+    return [iface
+        for iface, props in _data.interfaces.items()
+        if prop in props]
+
+def scan_all_grob_properties():
+    """Computes all_grob_properties() from the tables."""
+    return sorted(set(sum(_data.interfaces.values(), [])))
+
+
+def main():
+    """Runs the benchmarks and prints the results (msec per round)."""
+    grobs = sorted(_data.grobs)
+    props = ly.data.all_grob_properties()
+    tests = [
+        ("grob_properties (all grobs)",
+            lambda: [scan_grob_properties(g) for g in grobs],
+            lambda: [ly.data.grob_properties(g) for g in grobs]),
+        ("grob_interfaces_for_property (all props)",
+            lambda: [scan_grob_interfaces_for_property(p) for p in props],
+            lambda: [ly.data.grob_interfaces_for_property(p) for p in props]),
+        ("all_grob_properties",
+            scan_all_grob_properties,
+            ly.data.all_grob_properties),
+    ]
+    rounds = 20
+    print("{0:42} {1:>10} {2:>10}".format("query", "scan", "index"))
+    for name, scan, index in tests:
+        assert scan() == index()
+        t1 = timeit.timeit(scan, number=rounds) * 1000 / rounds
+        t2 = timeit.timeit(index, number=rounds) * 1000 / rounds
+        print("{0:42} {1:10.3f} {2:10.3f}".format(name, t1, t2))
+    t = timeit.timeit(lambda: reload(_data), number=rounds) * 1000 / rounds
+    print("{0:42} {1:10.3f}".format("building the indexes (import)", t))
+
+
+if __name__ == '__main__':
+    main()
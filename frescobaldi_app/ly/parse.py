@@ -105,3 +105,64 @@ def markup_commands(tokens):
                     break
 
 
+
+
+def definitions(tokens, state=None):
+    """Finds the \\include arguments and markup command definitions in a line.
+    
+    This finds the same as includeargs() and markup_commands(), but in the
+    tokens of one line at a time. Returns a three-tuple (includeargs,
+    markup_commands, state). The state describes a construct that is not yet
+    complete at the end of the line (e.g. an \\include command with its
+    argument on the next line); give it as state with the tokens of the next
+    line to complete the construct there. It is None if there is no such
+    construct. States can be compared with each other.
+    
+    """
+    includeargs, markup_commands = [], []
+    for t in tokens:
+        if state is not None:
+            kind = state[0]
+            if kind == 'include':
+                if isinstance(t, (lex.Space, lex.Comment)):
+                    continue
+                if t == '"':
+                    state = ('includearg', '')
+                    continue
+            elif kind == 'includearg':
+                if t == '"':
+                    includeargs.append(state[1])
+                    state = None
+                else:
+                    state = ('includearg', state[1] + t)
+                continue
+            elif kind == 'define':
+                if isinstance(t, lex.scheme.Word):
+                    markup_commands.append(unicode(t))
+                    state = None
+                    continue
+                if state[1] > 1:
+                    state = ('define', state[1] - 1)
+                    continue
+            elif kind == 'name':
+                name, count, equals = state[1:]
+                if count > 0:
+                    if isinstance(t, lex.Space):
+                        state = ('name', name, count - 1, equals)
+                        continue
+                    if not equals and t == '=':
+                        state = ('name', name, count - 1, True)
+                        continue
+                    if equals and t == '\\markup':
+                        markup_commands.append(name)
+                        state = None
+                        continue
+            state = None
+        # the token may start a construct
+        if isinstance(t, lex.lilypond.Keyword) and t == "\\include":
+            state = ('include',)
+        elif isinstance(t, lex.scheme.Word) and t == 'define-markup-command':
+            state = ('define', 5)
+        elif isinstance(t, lex.lilypond.Name):
+            state = ('name', unicode(t), 4, False)
+    return includeargs, markup_commands, state
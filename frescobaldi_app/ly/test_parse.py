@@ -0,0 +1,89 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Tests for ly.parse.
+
+Run from the frescobaldi_app directory with:
+
+    python -m unittest ly.test_parse
+
+"""
+
+from __future__ import unicode_literals
+
+import unittest
+
+import ly.lex
+import ly.parse
+
+
+def lines(text):
+    """Returns a list of token tuples, one for every line of text."""
+    state = ly.lex.state('lilypond')
+    return [tuple(state.tokens(line)) for line in text.split('\n')]
+
+
+def definitions(text):
+    """Runs definitions() line by line, returns (includeargs, markup_commands, states)."""
+    includeargs, markup_commands, states = [], [], []
+    state = None
+    for tokens in lines(text):
+        i, m, state = ly.parse.definitions(tokens, state)
+        includeargs.extend(i)
+        markup_commands.extend(m)
+        states.append(state)
+    return includeargs, markup_commands, states
+
+
+class DefinitionsTest(unittest.TestCase):
+    def test_include_one_line(self):
+        includeargs, markup_commands, states = definitions('\\include "a.ly"\n')
+        self.assertEqual(includeargs, ["a.ly"])
+        self.assertEqual(states, [None, None])
+
+    def test_include_two_lines(self):
+        text = '\\include\n  "b.ly"\n{ c }\n'
+        includeargs, markup_commands, states = definitions(text)
+        self.assertEqual(includeargs, ["b.ly"])
+        self.assertNotEqual(states[0], None)
+        self.assertEqual(states[1:], [None, None, None])
+        # the argument is found in the line where it ends
+        includeargs, markup_commands, state = ly.parse.definitions(lines(text)[0])
+        self.assertEqual(includeargs, [])
+        includeargs, markup_commands, state = ly.parse.definitions(lines(text)[1], state)
+        self.assertEqual(includeargs, ["b.ly"])
+
+    def test_markup_assignment_two_lines(self):
+        text = 'title =\n\\markup { Hi }\n'
+        includeargs, markup_commands, states = definitions(text)
+        self.assertEqual(markup_commands, ["title"])
+
+    def test_same_as_whole_text(self):
+        text = ('\\include\n"c.ly"\nfoo =\n  \\markup x\n'
+                '#(define-markup-command (mycmd layout props) ())\n'
+                'bar = { c d }\n\\include "d.ly"\n')
+        includeargs, markup_commands, states = definitions(text)
+        tokens = list(ly.lex.state('lilypond').tokens(text))
+        self.assertEqual(includeargs, list(ly.parse.includeargs(iter(tokens))))
+        self.assertEqual(markup_commands, list(ly.parse.markup_commands(iter(tokens))))
+
+
+if __name__ == '__main__':
+    unittest.main()
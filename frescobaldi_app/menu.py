@@ -239,11 +239,14 @@ def menu_lilypond(mainwindow):
     ac = engrave.engraver(mainwindow).actionCollection
     
     m.addAction(ac.engrave_sticky)
+    m.addAction(ac.engrave_autocompile)
     m.addSeparator()
     m.addAction(ac.engrave_preview)
     m.addAction(ac.engrave_publish)
     m.addAction(ac.engrave_custom)
+    m.addAction(ac.engrave_all)
     m.addAction(ac.engrave_abort)
+    m.addAction(ac.engrave_abort_all)
     m.addSeparator()
     m.addMenu(menu_lilypond_generated_files(mainwindow))
     return m
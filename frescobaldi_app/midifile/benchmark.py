@@ -0,0 +1,164 @@
+#! python
+
+# Python midifile package -- parse, load and play MIDI files.
+# Copyright (c) 2011 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Benchmarks the Player by playing generated songs on a virtual clock.
+
+Run with: python -m midifile.benchmark
+
+For every song the following is reported:
+
+latency: how much later than scheduled (in msec) the events were handled,
+         when the time it takes to handle the events is taken into account.
+drift:   the difference between the time the MIDI events were sent and their
+         time as computed by the TempoMap of the song.
+cpu:     the processor time in microseconds per handled MIDI event.
+
+"""
+
+from __future__ import unicode_literals
+
+import random
+import struct
+import time
+
+from . import output
+from . import player
+from . import song
+
+
+def var_len(value):
+    """Returns the bytes of value as a variable-length integer."""
+    result = [value & 0x7F]
+    value >>= 7
+    while value:
+        result.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(bytearray(reversed(result)))
+
+
+def make_track(notes, controllers=8, tempos=0, seed=0, division=384):
+    """Returns the bytes of a MIDI track with the number of notes.
+
+    Between every two notes the number of controller events is written, and
+    the tempo is changed the number of tempos times, evenly spread.
+
+    """
+    r = random.Random(seed)
+    channel = seed % 16
+    data = [
+        var_len(0) + b'\xFF\x58\x04\x04\x02\x18\x08',
+        var_len(0) + b'\xFF\x51\x03\x07\xA1\x20',
+    ]
+    tempo_every = notes // tempos if tempos else 0
+    for i in range(notes):
+        note = r.randrange(36, 96)
+        data.append(var_len(0) + bytes(bytearray((0x90 | channel, note, 80))))
+        if tempo_every and i and not i % tempo_every:
+            tempo = r.randrange(300000, 1000000)
+            data.append(var_len(0) + b'\xFF\x51\x03' + struct.pack(b'>i', tempo)[1:])
+        length = division // 2
+        steps = controllers or 1
+        for c in range(controllers):
+            data.append(var_len(length // steps if c else 0)
+                + bytes(bytearray((0xB0 | channel, 1, r.randrange(128)))))
+        data.append(var_len(length - (length // steps) * (steps - 1))
+            + bytes(bytearray((0x80 | channel, note, 0))))
+    data.append(var_len(0) + b'\xFF\x2F\x00')
+    return b''.join(data)
+
+
+def make_song(notes=1000, controllers=8, tracks=4, tempos=16, division=384):
+    """Returns a Song with generated tracks, see make_track()."""
+    return song.Song(division, [make_track(notes, controllers, tempos, n, division)
+                                for n in range(tracks)])
+
+
+class BenchmarkPlayer(player.VirtualPlayer):
+    """A VirtualPlayer that keeps the scheduling latency of every event."""
+    def __init__(self, cost=True):
+        super(BenchmarkPlayer, self).__init__(cost)
+        self.latencies = []
+
+    def timer_timeout(self):
+        self.latencies.append(self.timer_midi_time() - self._sync_time)
+        super(BenchmarkPlayer, self).timer_timeout()
+
+
+def benchmark(s, tempo_factor=1.0, cost=True):
+    """Plays the Song s on a virtual clock and returns a dict with results.
+
+    The dict has the keys events, latency (average and maximum), drift
+    (average and maximum) and cpu (microseconds per MIDI event).
+
+    """
+    p = BenchmarkPlayer(cost)
+    p.set_song(s)
+    p.set_tempo_factor(tempo_factor)
+    out = output.RecordingOutput(p.timer_midi_time)
+    p.set_output(out)
+
+    expected = {}
+    for midi_time, d in s.events.items():
+        msec = s.tempo_map.msec(midi_time) / tempo_factor
+        for evs in d.values():
+            for e in evs:
+                expected[id(e)] = msec
+
+    t = time.clock()
+    p.start()
+    p.run()
+    cpu = time.clock() - t
+
+    drifts = [abs(sent - expected[id(e)])
+              for sent, e in out.events if id(e) in expected]
+    count = len(drifts) or 1
+    return {
+        'events': len(drifts),
+        'latency': (sum(p.latencies) / len(p.latencies), max(p.latencies)),
+        'drift': (sum(drifts) / count, max(drifts or [0])),
+        'cpu': cpu * 1000000 / count,
+    }
+
+
+def main():
+    """Runs the benchmarks and prints the results."""
+    configurations = [
+        # notes, controllers, tracks, tempos, tempo factor
+        (1000, 0, 4, 0, 1.0),
+        (1000, 8, 4, 16, 1.0),
+        (1000, 32, 4, 16, 1.0),
+        (500, 32, 16, 64, 1.0),
+        (1000, 8, 4, 16, 2.5),
+    ]
+    print("notes ctrls tracks tempos factor   events  latency(avg/max)  "
+          "drift(avg/max)   cpu/event")
+    for notes, controllers, tracks, tempos, factor in configurations:
+        s = make_song(notes, controllers, tracks, tempos)
+        r = benchmark(s, factor)
+        print("{0:5} {1:5} {2:6} {3:6} {4:6.1f} {5:8}  {6:7.3f} {7:8.3f}  "
+              "{8:7.3f} {9:7.3f}  {10:7.1f}us".format(
+              notes, controllers, tracks, tempos, factor, r['events'],
+              r['latency'][0], r['latency'][1], r['drift'][0], r['drift'][1],
+              r['cpu']))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,7 @@ Writes MIDI events to a MIDI output.
 from __future__ import unicode_literals
 
 import contextlib
+import time
 
 from . import event
 
@@ -113,6 +114,29 @@ class Output(object):
             self.send_events(l)
 
 
+class RecordingOutput(Output):
+    """Records the events with the time they are sent in the events attribute.
+    
+    The events attribute is a list of two-tuples (time, event). The time is
+    in msec and is returned by the clock function, which defaults to the time
+    from the Python time module. Use e.g. the timer_midi_time() method of a
+    Player to record the time of the player.
+    
+    """
+    def __init__(self, clock=None):
+        self.events = []
+        self.clock = clock or (lambda: time.time() * 1000)
+    
+    def send_events(self, events):
+        """Records the list of events with the current time."""
+        t = self.clock()
+        self.events.extend((t, e) for e in events)
+    
+    def clear(self):
+        """Forgets all recorded events."""
+        del self.events[:]
+
+
 class PortMidiOutput(Output):
     """Writes events to a PortMIDI Output instance.
     
@@ -27,6 +27,10 @@ its tracks.
 A basic event factory returns the MIDI events as simple named tuples,
 but you can subclass the event factory for more sophisticated behaviour.
 
+To load large files, use parse_midi_file(), which memory-maps the file and
+decodes every track into compact arrays (see TrackEvents), from which the
+event objects are created lazily.
+
 Runs with Python 2.6, 2.7.
 For Python 3 you can remove the ord() calls.
 
@@ -34,7 +38,9 @@ For Python 3 you can remove the ord() calls.
 
 from __future__ import unicode_literals
 
+import mmap
 import struct
+from array import array
 
 from . import event
 
@@ -47,12 +53,24 @@ def get_chunks(s):
     
     Yields (b'Name', b'data') tuples.
     
+    """
+    for name, start, end in get_chunk_positions(s):
+        yield name, s[start:end]
+
+
+def get_chunk_positions(s):
+    """Finds the chunks in MIDI file data without copying them.
+    
+    The data can be a bytes string, but also e.g. an mmap object.
+    Yields (b'Name', start, end) tuples.
+    
     """
     pos = 0
-    while pos < len(s):
-        name = s[pos:pos+4]
-        size, = unpack_int(s[pos+4:pos+8])
-        yield name, s[pos+8:pos+8+size]
+    length = len(s)
+    while pos < length:
+        name = bytes(s[pos:pos+4])
+        size, = unpack_int(bytes(s[pos+4:pos+8]))
+        yield name, pos + 8, min(length, pos + 8 + size)
         pos += size + 8
 
     
@@ -75,6 +93,39 @@ def parse_midi_data(s):
     raise ValueError("invalid midi data")
 
 
+def parse_midi_file(filename):
+    """Parses a MIDI file.
+    
+    Returns a three tuple (format_type, time_division, tracks).
+    Every track is a TrackEvents instance.
+    
+    The file is memory-mapped, and only the tracks are read, one at a time,
+    while they are decoded.
+    
+    May raise ValueError or IndexError in case of invalid MIDI data, or
+    IOError if the file could not be read.
+    
+    """
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            data = f.read() # e.g. an empty file
+    try:
+        chunks = get_chunk_positions(data)
+        for name, start, end in chunks:
+            if name == b'MThd':
+                fmt, ntracks, division = unpack_midi_header(bytes(data[start:start+6]))
+                tracks = [parse_track(data, start, end)
+                          for name, start, end in chunks if name == b'MTrk']
+                return fmt, division, tracks
+            break
+        raise ValueError("invalid midi data")
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
 def read_var_len(s, pos):
     """Reads variable-length integer from s starting on pos.
     
@@ -90,12 +141,15 @@ def read_var_len(s, pos):
             return value, pos
 
 
-def parse_midi_events(s, factory=None):
+def parse_midi_events(s, factory=None, start=0, end=None):
     """Parses the bytes string s (typically a track) for MIDI events.
     
     If factory is given, it should be an EventFactory instance that
     returns objects describing the event.
     
+    If start and/or end are given, only that part of s is parsed. In this way
+    a track can be read directly from e.g. an mmap object, without copying it.
+    
     Yields two-tuples (delta, event).
     
     Raises ValueError or IndexError on invalid MIDI data.
@@ -103,11 +157,13 @@ def parse_midi_events(s, factory=None):
     """
     if factory is None:
         factory = event.EventFactory()
+    if end is None:
+        end = len(s)
         
     running_status = None
     
-    pos = 0
-    while pos < len(s):
+    pos = start
+    while pos < end:
         
         delta, pos = read_var_len(s, pos)
         
@@ -168,6 +224,148 @@ def parse_midi_events(s, factory=None):
         yield delta, ev
 
 
+def parse_track(s, start=0, end=None):
+    """Parses the bytes string s (typically a track) into a TrackEvents instance.
+    
+    If start and/or end are given, only that part of s is parsed.
+    
+    Raises ValueError or IndexError on invalid MIDI data.
+    
+    """
+    # a bytearray yields integers, which is faster than ord() on every byte
+    b = bytearray(s[start:end])
+    track = TrackEvents()
+    deltas = track.deltas.append
+    statuses = track.status.append
+    data1 = track.data1.append
+    data2 = track.data2.append
+    
+    def var_len(pos):
+        value = 0
+        while True:
+            i = b[pos]
+            pos += 1
+            value = value * 128 + (i & 0x7F)
+            if not i & 0x80:
+                return value, pos
+    
+    def payload(size, pos):
+        track.offsets.append(len(track.data))
+        track.sizes.append(size)
+        track.data.extend(b[pos:pos+size])
+        return pos + size
+    
+    running_status = None
+    pos = 0
+    length = len(b)
+    while pos < length:
+        delta, pos = var_len(pos)
+        status = b[pos]
+        if status & 0x80:
+            running_status = status
+            pos += 1
+        elif not running_status:
+            raise ValueError("invalid running status")
+        else:
+            status = running_status
+        
+        ev_type = status >> 4
+        if ev_type >= 0x0F:
+            running_status = None
+            if status == 0xFF:
+                # meta event
+                d1 = b[pos]
+                size, pos = var_len(pos + 1)
+            else:
+                # some sort of sysex
+                d1 = 0
+                size, pos = var_len(pos)
+            pos = payload(size, pos)
+            d2 = 0
+        elif ev_type in (0xC, 0xD):
+            # Program Change, Channel AfterTouch
+            d1, d2 = b[pos], 0
+            pos += 1
+        else:
+            # note on, off, aftertouch, controller, pitch bend
+            d1, d2 = b[pos], b[pos+1]
+            pos += 2
+        deltas(delta)
+        statuses(status)
+        data1(d1)
+        data2(d2)
+    return track
+
+
+class TrackEvents(object):
+    """The events of a track, decoded into compact arrays.
+    
+    For every event the delta time, the status byte and two data bytes are
+    stored. For meta events, data1 is the meta type. The data of the meta and
+    sysex events is stored in one bytearray, with the offset and size of every
+    meta or sysex event in two more arrays.
+    
+    Use events() to get (delta, event) two-tuples like parse_midi_events().
+    
+    """
+    def __init__(self):
+        self.deltas = array(str('L'))
+        self.status = array(str('B'))
+        self.data1 = array(str('B'))
+        self.data2 = array(str('B'))
+        self.offsets = array(str('L'))
+        self.sizes = array(str('L'))
+        self.data = bytearray()
+    
+    def __len__(self):
+        """Returns the number of events."""
+        return len(self.status)
+    
+    def events(self, factory=None):
+        """Yields two-tuples (delta, event), creating the events lazily.
+        
+        If factory is given, it should be an EventFactory instance that
+        returns objects describing the event.
+        
+        """
+        if factory is None:
+            factory = event.EventFactory()
+        meta = 0
+        for delta, status, d1, d2 in zip(self.deltas, self.status, self.data1, self.data2):
+            ev_type = status >> 4
+            channel = status & 0x0F
+            if ev_type <= 0x0A:
+                ev = factory.note_event(ev_type, channel, d1, d2)
+            elif ev_type >= 0x0F:
+                offset = self.offsets[meta]
+                data = bytes(self.data[offset:offset+self.sizes[meta]])
+                meta += 1
+                if status == 0xFF:
+                    ev = factory.meta_event(d1, data)
+                else:
+                    ev = factory.sysex_event(status, data)
+            elif ev_type == 0x0E:
+                ev = factory.pitchbend_event(channel, d1 + d2 * 128)
+            elif ev_type == 0xD:
+                ev = factory.channelaftertouch_event(channel, d1)
+            elif ev_type == 0xB:
+                ev = factory.controller_event(channel, d1, d2)
+            else: # ev_type == 0xC
+                ev = factory.programchange_event(channel, d1)
+            yield delta, ev
+
+
+def iter_events(track, factory=None):
+    """Yields two-tuples (delta, event) for the track.
+    
+    The track can be a bytes string or a TrackEvents instance.
+    
+    """
+    if isinstance(track, TrackEvents):
+        return track.events(factory)
+    return parse_midi_events(track, factory)
+
+
 def time_events(track, time=0):
     """Yields two-tuples (time, event).
     
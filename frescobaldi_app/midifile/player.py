@@ -24,6 +24,7 @@ A MIDI Player.
 
 from __future__ import unicode_literals
 
+import bisect
 import collections
 import time
 import threading
@@ -38,10 +39,16 @@ class Player(object):
     You can override: timer_midi_time(), timer_start() and timer_stop()
     to use another timing source than the Python threading.Timer instances.
     
+    The time events are not stored in the list of events, but scheduled
+    between the other events while playing.
+    
     """
     def __init__(self):
         self._song = None
         self._events = []
+        self._times = []
+        self._time_interval = None
+        self._tick = None
         self._position = 0
         self._offset = 0
         self._sync_time = 0
@@ -83,9 +90,11 @@ class Player(object):
         if playing:
             self.timer_stop_playing()
         self._song = song
-        self._events = make_event_list(song, time, beat)
+        self._events = make_event_list(song, beat=beat)
+        self._times = [t for t, e in self._events]
+        self._time_interval = time
         self._position = 0
-        self._offset = 0
+        self._offset = self.reset_tick(0)
         if playing:
             self.timer_start_playing()
     
@@ -99,6 +108,8 @@ class Player(object):
             self.stop()
         self._song = None
         self._events = []
+        self._times = []
+        self._tick = None
         self._position = 0
         self._offset = 0
         
@@ -113,7 +124,7 @@ class Player(object):
         if self._position >= len(self._events):
             time = self.total_time()
         else:
-            time = self._events[self._position][0]
+            time = self.next_time()
         if self._playing:
             return time - self.timer_offset()
         return time - self._offset
@@ -144,14 +155,7 @@ class Player(object):
         pos = 0
         offset = 0
         if time:
-            # bisect our way in the events list.
-            end = len(self._events)
-            while pos < end:
-                mid = (pos + end) // 2
-                if time > self._events[mid][0]:
-                    pos = mid + 1
-                else:
-                    end = mid
+            pos = bisect.bisect_left(self._times, time)
             if pos < len(self._events):
                 offset = self._events[pos][0] - time
         self.set_position(pos, offset)
@@ -162,19 +166,11 @@ class Player(object):
         Returns whether the measure position could be found (True or False).        
         
         """
-        result = False
-        for i, (t, e) in enumerate(self._events):
-            if e.beat:
-                if e.beat[0] == measnum:
-                    position = i
-                    result = True
-                    if e.beat[1] >= beat:
-                        break
-                if e.beat[0] > measnum:
-                    break
-        if result:
-            self.set_position(position)
-            return True
+        if self._song:
+            b = self._song.measure(measnum, beat)
+            if b:
+                self.seek(b[0])
+                return True
         return False
         
     def set_position(self, position, offset=0):
@@ -186,6 +182,7 @@ class Player(object):
         old, self._position = self._position, position
         if old != self._position:
             self.position_event(old, self._position)
+        offset = self.reset_tick(offset)
         if self._playing:
             self.timer_stop()
             self.timer_schedule(offset, False)
@@ -195,7 +192,30 @@ class Player(object):
     def has_events(self):
         """Returns True if there are events left to play."""
         return bool(self._events) and self._position < len(self._events)
+    
+    def reset_tick(self, offset):
+        """(Private) Sets the time of the next time event after changing position.
+        
+        The offset is the time before the event at the current position.
+        Returns the time before the next event or time event.
         
+        """
+        if not self._time_interval or not self.has_events():
+            self._tick = None
+            return offset
+        event_time = self._events[self._position][0]
+        time = event_time - offset
+        interval = self._time_interval
+        self._tick = -(-time // interval) * interval
+        return min(self._tick, event_time) - time
+    
+    def next_time(self):
+        """(Private) Returns the time of the next event or time event."""
+        time = self._events[self._position][0]
+        if self._tick is not None and self._tick < time:
+            return self._tick
+        return time
+    
     def next_event(self):
         """(Private) Handles the current event and advances to the next.
         
@@ -205,20 +225,34 @@ class Player(object):
         If there is no event to handle anymore, returns 0.
         If this event was the last, calls finish() and returns 0.
         
+        Time events are handled here as well, at every multiple of the time
+        interval given to set_song(), up to the time of the last event.
+        
         """
         if self.has_events():
             time, event = self._events[self._position]
-            self.handle_event(time, event)
+            tick = self._tick
+            if tick is not None and tick <= time:
+                self._tick = tick + self._time_interval
+                if tick < time:
+                    # only a time event
+                    self.time_event(tick)
+                    return min(self._tick, time) - tick
+            self.handle_event(time, event, tick == time)
             self._position += 1
             if self._position < len(self._events):
-                return self._events[self._position][0] - time
+                return self.next_time() - time
         return 0
     
-    def handle_event(self, time, event):
-        """(Private) Called for every event."""
+    def handle_event(self, time, event, time_event=False):
+        """(Private) Called for every event.
+        
+        If time_event is True, time_event() is called as well.
+        
+        """
         if event.midi:
             self.midi_event(event.midi)
-        if event.time:
+        if time_event:
             self.time_event(time)
         if event.beat:
             self.beat_event(*event.beat)
@@ -353,12 +387,65 @@ class Player(object):
         self.stop_event()
 
 
+class VirtualPlayer(Player):
+    """A Player that runs on a virtual clock instead of real timers.
+    
+    Call start() and then run() to play the song (or a part of it) as fast
+    as possible. The time reported by timer_midi_time() is the virtual time,
+    so Output instances and the event methods see the same times as they
+    would when playing in real time.
+    
+    If cost is True, the virtual clock is also advanced by the real time it
+    takes to handle every event, so that events that are handled too slowly
+    are delayed, just like they would be by a real timer.
+    
+    """
+    def __init__(self, cost=False):
+        super(VirtualPlayer, self).__init__()
+        self._cost = cost
+        self._clock = 0.0
+        self._timeout = None
+    
+    def run(self, until=None):
+        """Runs the timer until playing has stopped.
+        
+        If until is given, stops running (without stopping playback) when the
+        virtual clock would pass that time in msec.
+        
+        """
+        while self._timeout is not None:
+            if until is not None and self._timeout > until:
+                self._clock = max(self._clock, until)
+                break
+            self._clock = max(self._clock, self._timeout)
+            self._timeout = None
+            if self._cost:
+                t = time.time()
+                self.timer_timeout()
+                self._clock += (time.time() - t) * 1000
+            else:
+                self.timer_timeout()
+    
+    def timer_midi_time(self):
+        """Returns the virtual time in msec."""
+        return self._clock
+    
+    def timer_start(self, msec):
+        """Sets the virtual time the timer fires."""
+        self._timeout = self._clock + msec
+    
+    def timer_stop(self):
+        """Stops the timer."""
+        self._timeout = None
+
+
 class Event(object):
     """Any event (MIDI, Time and/or Beat).
     
     Has three attributes that determine what the Player does:
     
-    time: if True, time_event() is caled with the current music time.
+    time: if True, time_event() is called with the current music time.
+          (The Player itself does not create Events for the time events.)
     beat: None or (measnum, beat, num, den), then beat_event() is called.
     midi: If not None, midi_event() is called with the midi.
     
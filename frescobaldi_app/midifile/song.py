@@ -24,6 +24,7 @@ midifile.song -- structures MIDI file data as a song.
 
 from __future__ import unicode_literals
 
+import bisect
 import collections
 
 from . import event
@@ -36,7 +37,7 @@ def load(filename):
     If the filename is a type 2 MIDI file, just returns the first track.
     
     """
-    fmt, div, tracks = parser.parse_midi_data(open(filename, 'rb').read())
+    fmt, div, tracks = parser.parse_midi_file(filename)
     if fmt == 2:
         tracks = tracks[:1]
     return Song(div, tracks)
@@ -51,7 +52,7 @@ def events_dict(tracks):
     d = collections.defaultdict(dict)
     for n, track in enumerate(tracks):
         for time, evs in parser.time_events_grouped(
-                parser.parse_midi_events(track)):
+                parser.iter_events(track)):
             d[time][n] = evs
     return d
 
@@ -65,7 +66,7 @@ def events_dict_together(tracks):
     d = collections.defaultdict(list)
     for track in tracks:
         for time, evs in parser.time_events_grouped(
-                parser.parse_midi_events(track)):
+                parser.iter_events(track)):
             d[time].extend(evs)
     return d
 
@@ -118,7 +119,12 @@ def iter_events_dict(evs):
 
 
 class TempoMap(object):
-    """Converts midi time to real time in microseconds."""
+    """Converts midi time to real time in microseconds.
+    
+    At every tempo change the real time elapsed since the start is stored, so
+    a conversion only needs to bisect in the list of tempo changes.
+    
+    """
     def __init__(self, d, division):
         """Initialize our tempo map based on events d and division."""
         # are the events one list (single-track) or a dict (per-track)?
@@ -133,23 +139,65 @@ class TempoMap(object):
                         break
         if not times or times[0][0] != 0:
             times.insert(0, (0, 500000))
-        
+        # the MIDI time, tempo and real time (multiplied by division) of
+        # every tempo change
+        self._midi_times = [midi_time for midi_time, tempo in times]
+        self._tempos = [tempo for midi_time, tempo in times]
+        self._real_times = real_times = [0]
+        for i in range(1, len(times)):
+            real_times.append(real_times[-1]
+                + (times[i][0] - times[i-1][0]) * times[i-1][1])
+    
+    def _real_time(self, i, midi_time):
+        """(Internal) Returns the real time using the tempo change at index i."""
+        return (self._real_times[i] + (midi_time - self._midi_times[i])
+                * self._tempos[i]) // self.division
+    
     def real_time(self, midi_time):
         """Returns the real time in microseconds for the given MIDI time."""
-        real_time = 0
-        times = self.times
-        for i in range(1, len(times)):
-            if times[i][0] >= midi_time:
-                real_time += (midi_time - times[i-1][0]) * times[i-1][1]
-                break
-            real_time += (times[i][0] - times[i-1][0]) * times[i-1][1]
-        else:
-            real_time += (midi_time - times[-1][0]) * times[-1][1]
-        return real_time // self.division
+        i = max(0, bisect.bisect_right(self._midi_times, midi_time) - 1)
+        return self._real_time(i, midi_time)
     
     def msec(self, midi_time):
         """Returns the real time in milliseconds."""
         return self.real_time(midi_time) // 1000
+    
+    def real_times(self, midi_times):
+        """Returns a list with the real times in microseconds for many MIDI times.
+        
+        This is fastest when the MIDI times are sorted, because then the tempo
+        changes are just walked along instead of searched for every time.
+        
+        """
+        result = []
+        starts = self._midi_times
+        count = len(starts)
+        i = 0
+        start, end = starts[0], starts[1] if count > 1 else None
+        for midi_time in midi_times:
+            if midi_time < start or (end is not None and midi_time >= end):
+                i = max(0, bisect.bisect_right(starts, midi_time) - 1)
+                start = starts[i]
+                end = starts[i+1] if i + 1 < count else None
+            result.append(self._real_time(i, midi_time))
+        return result
+    
+    def msecs(self, midi_times):
+        """Returns a list with the real times in milliseconds for many MIDI times."""
+        return [real_time // 1000 for real_time in self.real_times(midi_times)]
+    
+    def midi_time(self, msec):
+        """Returns the MIDI time for the given real time in milliseconds.
+        
+        This is the inverse of msec(), but the MIDI time is rounded down.
+        
+        """
+        real_time = msec * 1000 * self.division
+        i = max(0, bisect.bisect_right(self._real_times, real_time) - 1)
+        tempo = self._tempos[i]
+        if not tempo:
+            return self._midi_times[i]
+        return self._midi_times[i] + (real_time - self._real_times[i]) // tempo
 
 
 def beats(d, division):
@@ -205,6 +253,7 @@ class Song(object):
             event).
     
     beats: a list of tuples(msec, measnum, beat, num, den) for every beat
+    measures: a list with the index in beats of the first beat of every measure
     music: a list of tuples(msec, d) where d is a dict mapping tracknr to events
     
     """
@@ -218,13 +267,30 @@ class Song(object):
 
         self.beats = b = []
         measnum = 0
-        for midi_time, beat, num, den in beats(self.events, division):
+        beatlist = list(beats(self.events, division))
+        msecs = t.msecs(midi_time for midi_time, beat, num, den in beatlist)
+        for msec, (midi_time, beat, num, den) in zip(msecs, beatlist):
             if beat == 1:
                 measnum += 1
-            b.append((t.msec(midi_time), measnum, beat, num, den))
-        self.music = [(t.msec(midi_time), evs)
-                      for midi_time, evs in sorted(self.events.items())]
-
+            b.append((msec, measnum, beat, num, den))
+        self.measures = [i for i, beat in enumerate(b) if beat[2] == 1]
+        items = sorted(self.events.items())
+        self.music = list(zip(t.msecs(midi_time for midi_time, evs in items),
+                              (evs for midi_time, evs in items)))
+
+    def measure(self, measnum, beat=1):
+        """Returns (time, measnum, beat, num, den) for the beat in the measure.
+        
+        If the measure has fewer beats, the last beat of the measure is
+        returned. Returns None if the measure does not exist.
+        
+        """
+        if not 0 < measnum <= len(self.measures):
+            return
+        index = self.measures[measnum - 1]
+        end = self.measures[measnum] if measnum < len(self.measures) else len(self.beats)
+        return self.beats[max(index, min(index + beat - 1, end - 1))]
+    
     def beat(self, time):
         """Returns (time, measnum, beat, num, den) for the beat at time."""
         if not self.beats:
@@ -36,6 +36,7 @@ except ImportError:
 
 import app
 import plugin
+import qpopplerview
 import resultfiles
 import signals
 import popplertools
@@ -76,6 +77,8 @@ def load(filename):
         doc = popplerqt4.Poppler.Document.loadFromData(data)
         if doc:
             _cache[key] = doc
+            # allows rendering pages in parallel
+            qpopplerview.cache.setsource(doc, data)
         return doc or None
 
 
@@ -91,7 +94,11 @@ class Document(popplertools.Document):
     updated = True
     
     def load(self):
-        return load(self.filename())
+        doc = load(self.filename())
+        if doc and self._document and doc is not self._document:
+            # don't render the pages again that did not change
+            qpopplerview.cache.reuse(self._document, doc)
+        return doc
         
     if popplerqt4 is None:
         def document(self):
@@ -27,8 +27,9 @@ import re
 import os
 import sys
 import weakref
+from array import array
 
-from PyQt4.QtCore import QUrl
+from PyQt4.QtCore import QPointF, QRectF, QThread, QUrl, pyqtSignal
 from PyQt4.QtGui import QTextCursor
 
 import qpopplerview
@@ -44,6 +45,9 @@ import percentcoding
 # cache point and click handlers for poppler documents
 _cache = weakref.WeakKeyDictionary()
 
+# keep running LinkReaders alive
+_readers = set()
+
 # parse textedit urls
 textedit_match = re.compile(r"^textedit://(.*?):(\d+):(\d+)(?::\d+)$").match
 
@@ -79,11 +83,16 @@ def readurl(match):
     return readfilename(match), int(match.group(2)), int(match.group(3))
 
 
-def links(document):
+def links(document, page=0):
+    """Returns the Links for the Poppler document.
+    
+    If the Links are created, the links are read starting at the given page.
+    
+    """
     try:
         return _cache[document]
     except KeyError:
-        l = _cache[document] = Links(document)
+        l = _cache[document] = Links(document, page)
         return l
 
 
@@ -92,42 +101,56 @@ class Links(object):
     
     Only textedit:// urls are stored.
     
+    The links are read in a background thread, page by page, starting at the
+    given page.
+    
     """
-    def __init__(self, document):
+    def __init__(self, document, page=0):
         self._links = {}
         self._docs = {}
         
-        import popplerqt4
-        with qpopplerview.lock(document):
-            for num in range(document.numPages()):
-                page = document.page(num)
-                for link in page.links():
-                    if isinstance(link, popplerqt4.Poppler.LinkBrowse):
-                        m = textedit_match(link.url())
-                        if m:
-                            filename, line, col = readurl(m)
-                            l = self._links.setdefault(filename, {})
-                            l.setdefault((line, col), []).append((num, link.linkArea()))
-
-        for filename in self._links:
-            for d in app.documents:
-                s = scratchdir.scratchdir(d)
-                if (s.directory() and util.equal_paths(filename, s.path())
-                    or d.url().toLocalFile() == filename):
-                    self.bind(filename, d)
         app.documentLoaded.connect(self.slotDocumentLoaded)
         app.documentClosed.connect(self.slotDocumentClosed)
+        
+        self._reader = reader = LinkReader(document, page)
+        reader.linksFound.connect(self.slotLinksFound)
+        reader.finished.connect(self.slotReaderFinished)
+        reader.start()
+    
+    def slotLinksFound(self, links):
+        """Called with a list of (filename, line, col, pageNum, linkArea) tuples."""
+        new = {}
+        for filename, line, col, num, area in links:
+            l = self._links.setdefault(filename, {})
+            dest = (num, area)
+            l.setdefault((line, col), []).append(dest)
+            new.setdefault(filename, []).append(((line, col), dest))
+        for filename, items in new.items():
+            try:
+                self._docs[filename].add(items)
+            except KeyError:
+                for d in app.documents:
+                    s = scratchdir.scratchdir(d)
+                    if (s.directory() and util.equal_paths(filename, s.path())
+                        or d.url().toLocalFile() == filename):
+                        self.bind(filename, d)
+                        break
+    
+    def slotReaderFinished(self):
+        """Called when the background thread has read all pages."""
+        self._reader = None
     
     def bind(self, filename, doc):
         """Binds the given filename to the given document.
         
         When the document disappears, the binding is removed automatically.
-        While a document is bound, textedit links are stored as QTextCursors,
-        so they keep their position even if the user changes the document.
+        While a document is bound, the positions of the textedit links are
+        kept up-to-date, even if the user changes the document.
         
         """
         if filename not in self._docs:
-            self._docs[filename] = BoundLinks(doc, self._links[filename])
+            b = self._docs[filename] = BoundLinks(doc)
+            b.add(self._links.get(filename, {}).items(), True)
     
     def slotDocumentLoaded(self, doc):
         """Called when a new document is loaded, it maybe possible to bind to it."""
@@ -174,41 +197,227 @@ class Links(object):
                 return b
 
 
+class LinkReader(QThread):
+    """Reads the textedit links of a Poppler document in a background thread.
+    
+    The pages are read in order, starting at the given page and wrapping
+    around. The linksFound signal is emitted with a list of (filename, line,
+    col, pageNum, linkArea) tuples for every batch of pages that is read.
+    
+    """
+    linksFound = pyqtSignal(object)
+    
+    # the number of pages read before their links are published
+    batchSize = 4
+    
+    def __init__(self, document, page=0):
+        super(LinkReader, self).__init__()
+        self.document = document
+        self.page = page
+        _readers.add(self)
+        self.finished.connect(self._done)
+    
+    def _done(self):
+        """(Internal) Called when the thread has finished."""
+        _readers.discard(self)
+        
+    def run(self):
+        """Main method of this thread, called by Qt on start()."""
+        import popplerqt4
+        LinkBrowse = popplerqt4.Poppler.LinkBrowse
+        count = self.document.numPages()
+        start = min(max(0, self.page), count)
+        links = []
+        for i, num in enumerate(range(start, count) + range(start), 1):
+            with qpopplerview.lock(self.document):
+                page = self.document.page(num)
+                pagelinks = page.links()
+            for link in pagelinks:
+                if isinstance(link, LinkBrowse):
+                    m = textedit_match(link.url())
+                    if m:
+                        filename, line, col = readurl(m)
+                        links.append((filename, line, col, num, link.linkArea()))
+            if links and (i % self.batchSize == 0 or i == count):
+                self.linksFound.emit(links)
+                links = []
+
+
 class BoundLinks(object):
-    """Stores links as QTextCursors for a document."""
-    def __init__(self, doc, links):
-        """Creates QTextCursor instances for every link, keeps a reference to the document."""
+    """Stores the links to a text document in a compact index.
+    
+    For every link the line and column, the text position and the
+    destinations (page number and link area) are stored in parallel arrays,
+    sorted on text position. An array of indexes sorted on line and column is
+    used to look up a link by its line and column.
+    
+    When the document is changed, the stored positions are not adjusted one
+    by one, but the shift is recorded in a Fenwick tree (binary indexed tree),
+    so that both an edit and looking up the current position of a link are
+    cheap, even with many thousands of links.
+    
+    Links are added in batches with add(), which determines their text
+    positions right away, so that they are shifted by later changes of the
+    document. The batches are merged into the index when the links are needed.
+    
+    """
+    def __init__(self, doc):
+        """Keeps a reference to the document and follows its changes."""
         self.document = doc
-        # make a sorted list of cursors with their [(pageNum, linkArea) ...] destinations list
-        self._cursor_dict = d = {}              # mapping from (line, col) to QTextCursor
-        self._cursors = cursors = []            # sorted list of the cursors
-        self._destinations = destinations = []  # corresponding list of destinations
-        for pos, dest in sorted(links.items()):
-            line, column = pos
+        self._lines = array(str('i'))       # line numbers
+        self._columns = array(str('i'))     # corresponding columns
+        self._order = array(str('i'))       # indexes sorted on line and column
+        self._positions = array(str('i'))   # text positions (without shifts)
+        self._shifts = array(str('i'))      # Fenwick tree of position shifts
+        self._offsets = array(str('i'), [0])  # start of destinations of every link
+        self._pages = array(str('i'))       # page number of every destination
+        self._rects = array(str('d'))       # left, top, right, bottom of every destination
+        self._pending = []                  # links that are not in the index yet
+        doc.contentsChange.connect(self.slotContentsChange)
+    
+    def add(self, links, grouped=False):
+        """Adds links, a list of ((line, col), destination) tuples.
+        
+        If grouped is True, every item contains a list of destinations instead.
+        The line and column are converted to a position in the current text;
+        the links are merged into the index later, when they are needed.
+        
+        """
+        if not grouped:
+            links = [(pos, [dest]) for pos, dest in links]
+        doc = self.document
+        for (line, column), dests in links:
             b = doc.findBlockByNumber(line - 1)
             if b.isValid():
-                c = d[pos] = QTextCursor(doc)
-                c.setPosition(b.position() + column)
-                cursors.append(c)
-                destinations.append(dest)
+                position = b.position() + min(column, b.length() - 1)
+                self._pending.extend(((line, column), position, dest) for dest in dests)
+    
+    def _update(self):
+        """(Internal) Rebuilds the index if links have been added."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        links = {}  # (line, col): [position, list of (pageNum, coords)]
+        for i in range(len(self._positions)):
+            dests = [(self._pages[j], self._rects[j*4:j*4+4])
+                     for j in range(self._offsets[i], self._offsets[i+1])]
+            links[(self._lines[i], self._columns[i])] = [self.position(i), dests]
+        for pos, position, (num, rect) in pending:
+            dest = (num, rect.normalized().getCoords())
+            try:
+                links[pos][1].append(dest)
+            except KeyError:
+                links[pos] = [position, [dest]]
+        self._lines = array(str('i'))
+        self._columns = array(str('i'))
+        self._positions = array(str('i'))
+        self._offsets = array(str('i'), [0])
+        self._pages = array(str('i'))
+        self._rects = array(str('d'))
+        items = sorted(links.items(), key=lambda item: (item[1][0], item[0]))
+        for (line, column), (position, dests) in items:
+            self._lines.append(line)
+            self._columns.append(column)
+            self._positions.append(position)
+            for num, coords in dests:
+                self._pages.append(num)
+                self._rects.extend(coords)
+            self._offsets.append(len(self._pages))
+        self._shifts = array(str('i'), [0]) * len(self._positions)
+        self._order = array(str('i'), sorted(range(len(items)), key=lambda i: items[i][0]))
+    
+    def _shift(self, index, delta):
+        """(Internal) Adds delta to the positions of the links from index on."""
+        shifts = self._shifts
+        i = index + 1
+        count = len(shifts)
+        while i <= count:
+            shifts[i-1] += delta
+            i += i & -i
+    
+    def position(self, index):
+        """Returns the current text position of the link at index."""
+        shifts = self._shifts
+        position = self._positions[index]
+        i = index + 1
+        while i > 0:
+            position += shifts[i-1]
+            i -= i & -i
+        return position
+    
+    def _findlink(self, position):
+        """(Internal) Returns the index of the last link at or before position.
         
+        Returns -1 if there is no link at or before the position.
+        
+        """
+        lo, hi = 0, len(self._positions)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if position < self.position(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo - 1
+    
+    def slotContentsChange(self, position, removed, added):
+        """Called when the document changes; adjusts the positions of the links.
+        
+        Links after the changed text are moved, links inside the removed
+        text are moved to its start, like QTextCursors would be.
+        
+        """
+        self._update()  # the positions of pending links must be adjusted too
+        if not self._positions:
+            return
+        start = self._findlink(position) + 1
+        end = self._findlink(position + removed - 1) + 1
+        for index in range(start, end):
+            self._positions[index] += position - self.position(index)
+        if added != removed and end < len(self._positions):
+            self._shift(end, added - removed)
+    
     def cursor(self, line, column):
-        """Returns the QTextCursor for the give line/col."""
-        return self._cursor_dict.get((line, column))
+        """Returns a QTextCursor for the given line/col."""
+        self._update()
+        lines, columns, order = self._lines, self._columns, self._order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (lines[order[mid]], columns[order[mid]]) < (line, column):
+                lo = mid + 1
+            else:
+                hi = mid
+        c = QTextCursor(self.document)
+        if lo < len(order) and lines[order[lo]] == line and columns[order[lo]] == column:
+            c.setPosition(self.position(order[lo]))
+            return c
+        # the link was not read yet
+        b = self.document.findBlockByNumber(line - 1)
+        if b.isValid():
+            c.setPosition(b.position() + min(column, b.length() - 1))
+            return c
     
     def cursors(self):
-        """Returns the list of cursors, sorted on cursor position."""
-        return self._cursors
+        """Returns a list of new QTextCursors at the links, sorted on position."""
+        self._update()
+        cursors = []
+        for i in range(len(self._positions)):
+            c = QTextCursor(self.document)
+            c.setPosition(self.position(i))
+            cursors.append(c)
+        return cursors
         
     def destinations(self):
-        """Returns the list of destinations.
+        """Returns the sequence of destinations.
         
-        Each destination corresponds with the cursor at the same index in the cursors() list.
+        Each destination corresponds with the link at the same index in the cursors() list.
         Each destination is a list of (pageNum, QRectF) pairs, because many point-and-click
         objects can point to the same place in the text document.
         
         """
-        return self._destinations
+        self._update()
+        return Destinations(self)
     
     def indices(self, cursor):
         """Returns a Python slice object or None or False.
@@ -223,24 +432,15 @@ class BoundLinks(object):
         points to the _ending_ point of a slur, beam or phrasing slur.
         
         """
-        cursors = self._cursors
-        
-        def findlink(pos):
-            # binary search in list of cursors
-            lo, hi = 0, len(cursors)
-            while lo < hi:
-                mid = (lo + hi) // 2
-                if pos < cursors[mid].position():
-                    hi = mid
-                else:
-                    lo = mid + 1
-            return lo - 1
+        self._update()
+        findlink = self._findlink
+        position = self.position
         
         if cursor.hasSelection():
             end = findlink(cursor.selectionEnd() - 1)
             if end >= 0:
                 start = findlink(cursor.selectionStart())
-                if start < 0 or cursors[start].position() < cursor.selectionStart():
+                if start < 0 or position(start) < cursor.selectionStart():
                     start += 1
                 if start <= end:
                     return slice(start, end+1)
@@ -250,13 +450,14 @@ class BoundLinks(object):
         if index < 0:
             return # before all other links
         
-        cur2 = cursors[index]
-        if cur2.position() < cursor.position():
+        pos2 = position(index)
+        block = cursor.block()
+        if pos2 < cursor.position():
             # is the cursor at an ending token like a slur end?
             prevcol = -1
-            if cur2.block() == cursor.block():
-                prevcol = cur2.position() - cur2.block().position()
-            col = cursor.position() - cursor.block().position()
+            if pos2 >= block.position():
+                prevcol = pos2 - block.position()
+            col = cursor.position() - block.position()
             found = False
             tokens = tokeniter.Runner(cursor.block(), True)
             for token in tokens.backward_line():
@@ -279,11 +480,36 @@ class BoundLinks(object):
                         break
             if found:
                 index = findlink(tokens.block.position() + token.pos)
-                if index < 0 or cursors[index].block() != tokens.block:
+                if index < 0 or not tokens.block.contains(position(index)):
                     return
-            elif cur2.block() != cursor.block():
+            elif pos2 < block.position():
                 return False
         # highlight it!
         return slice(index, index+1)
 
 
+class Destinations(object):
+    """The sequence of destinations of the links in a BoundLinks index.
+    
+    Every item is a list of (pageNum, QRectF) pairs; the items are created
+    when they are requested.
+    
+    """
+    def __init__(self, links):
+        self._links = links
+    
+    def __len__(self):
+        return len(self._links._positions)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("destination index out of range")
+        links = self._links
+        rects = links._rects
+        return [(links._pages[j], QRectF(QPointF(rects[j*4], rects[j*4+1]),
+                                         QPointF(rects[j*4+2], rects[j*4+3])))
+                for j in range(links._offsets[index], links._offsets[index+1])]
@@ -109,9 +109,9 @@ class MusicView(QWidget):
         self._currentDocument = doc
         document = doc.document()
         if document:
-            self._links = pointandclick.links(document)
-            self.view.load(document)
             position = self._positions.get(doc, (0, 0, 0))
+            self._links = pointandclick.links(document, position[0] or 0)
+            self.view.load(document)
             self.view.setPosition(position, True)
 
     def clear(self):
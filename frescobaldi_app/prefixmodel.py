@@ -0,0 +1,161 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Completion models that quickly find the strings starting with a prefix.
+
+A SortedStrings instance keeps a sorted list of strings, so the strings
+starting with a prefix are found with a binary search. Strings can be added
+and removed one by one.
+
+A PrefixModel shows the strings from one or more SortedStrings that start
+with its prefix, the most often used strings first. Set it as the model of a
+QCompleter with the UnfilteredPopupCompletion mode, and call setPrefix()
+instead of (or before) the QCompleter's setCompletionPrefix().
+
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+
+from PyQt4.QtCore import QAbstractListModel, Qt
+
+
+class SortedStrings(object):
+    """A sorted list of unique strings, each with a reference count.
+
+    A string that is added more than once must also be removed that many
+    times before it disappears. The revision attribute is incremented every
+    time the list changes.
+
+    """
+    def __init__(self, strings=()):
+        self._counts = {}
+        for s in strings:
+            self._counts[s] = self._counts.get(s, 0) + 1
+        self._strings = sorted(self._counts)
+        self.revision = 0
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __iter__(self):
+        return iter(self._strings)
+
+    def __contains__(self, s):
+        return s in self._counts
+
+    def add(self, s):
+        """Adds a string (or increments its reference count)."""
+        count = self._counts.get(s, 0)
+        self._counts[s] = count + 1
+        if not count:
+            bisect.insort(self._strings, s)
+            self.revision += 1
+
+    def remove(self, s):
+        """Decrements the reference count of a string, removing it at zero."""
+        count = self._counts[s] - 1
+        if count:
+            self._counts[s] = count
+        else:
+            del self._counts[s]
+            del self._strings[bisect.bisect_left(self._strings, s)]
+            self.revision += 1
+
+    def count(self, s):
+        """Returns the reference count of the string, 0 if not present."""
+        return self._counts.get(s, 0)
+
+    def range(self, prefix):
+        """Returns the range (start, end) of the strings starting with prefix."""
+        start = bisect.bisect_left(self._strings, prefix)
+        end = bisect.bisect_left(self._strings, prefix + '\uffff', start)
+        return start, end
+
+    def startingwith(self, prefix):
+        """Returns the list of strings starting with prefix."""
+        start, end = self.range(prefix)
+        return self._strings[start:end]
+
+
+class PrefixModel(QAbstractListModel):
+    """Shows the strings from SortedStrings instances that start with a prefix.
+
+    The rank function, if given, should return a number for a string. Strings
+    with a higher number are shown first, strings with the same number in
+    alphabetical order.
+
+    When the prefix is extended, only the strings already shown are filtered.
+    When one of the sources has changed, they are queried again.
+
+    """
+    def __init__(self, sources, parent=None, rank=None):
+        super(PrefixModel, self).__init__(parent)
+        self._sources = sources
+        self._rank = rank
+        self._prefix = ''
+        self._revisions = [source.revision for source in sources]
+        self._data = self._strings('')
+
+    def sources(self):
+        """Returns the list of SortedStrings this model shows strings from."""
+        return self._sources
+
+    def prefix(self):
+        """Returns the current prefix."""
+        return self._prefix
+
+    def setPrefix(self, prefix):
+        """Shows the strings that start with the prefix."""
+        revisions = [source.revision for source in self._sources]
+        if prefix == self._prefix and revisions == self._revisions:
+            return
+        self.beginResetModel()
+        if prefix.startswith(self._prefix) and revisions == self._revisions:
+            self._data = [s for s in self._data if s.startswith(prefix)]
+        else:
+            self._data = self._strings(prefix)
+        self._prefix = prefix
+        self._revisions = revisions
+        self.endResetModel()
+
+    def _strings(self, prefix):
+        """(Internal) Returns the sorted list of strings starting with prefix."""
+        if len(self._sources) == 1:
+            strings = self._sources[0].startingwith(prefix)
+        else:
+            strings = set()
+            for source in self._sources:
+                strings.update(source.startingwith(prefix))
+        if self._rank:
+            rank = self._rank
+            return sorted(strings, key=lambda s: (-rank(s), s))
+        return sorted(strings)
+
+    def rowCount(self, parent):
+        return 0 if parent.isValid() else len(self._data)
+
+    def data(self, index, role):
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            try:
+                return self._data[index.row()]
+            except IndexError:
+                pass
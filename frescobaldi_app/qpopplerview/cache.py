@@ -20,9 +20,28 @@
 
 """
 Caching of generated images.
+
+Large pages (e.g. at a high zoom level) are not rendered as a whole, but in
+tiles of tilesize by tilesize pixels. Only the tiles that are needed to paint
+the visible part of a page are rendered.
+
+Until a page is rendered at the requested size, a low resolution preview of
+the page (rendered at previewdpi) is rendered first and shown scaled up.
+Previews are cheap to render, and generatepreviews() can be used to render
+them for all pages of a document in the background.
+
+When a document is reloaded (e.g. after re-engraving), reuse() carries the
+images and links of the pages that did not change over to the new document,
+comparing the pages by a hash of their contents, which is computed in a
+background thread.
+
+The images are kept in least recently used order, so when the cache grows
+beyond its maximum size, the oldest images can be dropped without sorting.
+Use statistics() to see how well the cache performs with a given size.
+
 """
 
-import time
+import collections
 import weakref
 
 try:
@@ -30,27 +49,57 @@ try:
 except ImportError:
     from . import popplerqt4_dummy as popplerqt4
 
-from PyQt4.QtCore import QThread
+from PyQt4.QtCore import QRect, QThread
 
+from . import contenthash
 from . import render
 from . import rectangles
 from .locking import lock
 
-__all__ = ['maxsize', 'setmaxsize', 'image', 'generate', 'clear', 'links', 'options']
+__all__ = ['maxsize', 'setmaxsize', 'image', 'generate', 'clear', 'links', 'options',
+           'tiled', 'tiles', 'tilerect', 'tile', 'statistics', 'resetstatistics',
+           'setsource', 'previewsize', 'generatepreviews', 'reuse']
 
 
-_cache = weakref.WeakKeyDictionary()
+# All images and tiles, least recently used first. The key is a tuple
+# (docref, pageNumber, rotation, width, height, tile), where docref is a weak
+# reference to the Poppler.Document and tile is None for a whole page.
+_images = collections.OrderedDict()
+
+_sizes = weakref.WeakKeyDictionary()    # document: {pageKey: set of sizeKeys}
+_refs = weakref.WeakKeyDictionary()     # document: docref
 _schedulers = weakref.WeakKeyDictionary()
 _options = weakref.WeakKeyDictionary()
 _links = weakref.WeakKeyDictionary()
+_sources = weakref.WeakKeyDictionary()  # document: data it was loaded from
+_hashes = weakref.WeakKeyDictionary()   # document: list of page hashes
+_runners = set()
+_hashrunners = set()
 
 
 # cache size
 _maxsize = 104857600 # 100M
 _currentsize = 0
 
+# statistics
+_hits = 0
+_misses = 0
+_evictions = 0
+
 _globaloptions = None
 
+# the width and height of a tile
+tilesize = 512
+
+# pages with more pixels than this are rendered in tiles
+tilethreshold = 2048 * 2048
+
+# the resolution of the previews shown while a page is being rendered
+previewdpi = 24.0
+
+# the maximum number of images that are rendered at the same time
+maxthreads = max(1, QThread.idealThreadCount())
+
 
 def setmaxsize(maxsize):
     """Sets the maximum cache size in Megabytes."""
@@ -64,19 +113,75 @@ def maxsize():
     return _maxsize / 1048576
 
 
+def statistics():
+    """Returns a dictionary with information about the use of the cache.
+    
+    The keys are 'hits', 'misses' and 'evictions' (counted since the start or
+    the last call to resetstatistics()), 'images' (the number of images and
+    tiles currently in the cache), 'size' and 'maxsize' (in bytes).
+    
+    """
+    return {
+        'hits': _hits,
+        'misses': _misses,
+        'evictions': _evictions,
+        'images': len(_images),
+        'size': _currentsize,
+        'maxsize': _maxsize,
+    }
+
+
+def resetstatistics():
+    """Resets the hit, miss and eviction counters."""
+    global _hits, _misses, _evictions
+    _hits = _misses = _evictions = 0
+
+
 def clear(document=None):
     """Clears the whole cache or the cache for the given Poppler.Document."""
+    global _currentsize
     if document:
         try:
-            del _cache[document]
+            ref = _refs[document]
         except KeyError:
-            pass
+            return
+        _remove(ref)
+        _sizes.pop(document, None)
     else:
-        _cache.clear()
-        global _currentsize
+        _images.clear()
+        _sizes.clear()
         _currentsize = 0
 
 
+def _remove(ref):
+    """(Internal) Removes all images of the document referred to by ref."""
+    global _currentsize
+    for key in [key for key in _images if key[0] is ref]:
+        _currentsize -= _images.pop(key).byteCount()
+
+
+def _docref(document):
+    """(Internal) Returns the weak reference used to key images of the document."""
+    try:
+        return _refs[document]
+    except KeyError:
+        ref = _refs[document] = weakref.ref(document, _remove)
+        return ref
+
+
+def _lookup(key):
+    """(Internal) Returns the image for the key, marking it as recently used."""
+    global _hits, _misses
+    try:
+        image = _images.pop(key)
+    except KeyError:
+        _misses += 1
+        return
+    _images[key] = image
+    _hits += 1
+    return image
+
+
 def image(page, exact=True):
     """Returns a rendered image for given Page if in cache.
     
@@ -85,78 +190,205 @@ def image(page, exact=True):
     rendering of the page scaled from a different size, if that was available.
     
     """
+    global _misses
     document = page.document()
+    try:
+        ref = _refs[document]
+    except KeyError:
+        if exact:
+            _misses += 1
+        return
     pageKey = (page.pageNumber(), page.rotation())
-    sizeKey = (page.width(), page.height())
     
     if exact:
-        try:
-            entry = _cache[document][pageKey][sizeKey]
-        except KeyError:
-            return
-        else:
-            entry[1] = time.time()
-            return entry[0]
+        return _lookup((ref,) + pageKey + (page.width(), page.height(), None))
     try:
-        sizes = _cache[document][pageKey].keys()
+        sizes = list(_sizes[document][pageKey])
     except KeyError:
         return
     # find the closest size (assuming aspect ratio has not changed)
     if sizes:
         sizes.sort(key=lambda s: abs(1 - s[0] / float(page.width())))
-        return _cache[document][pageKey][sizes[0]][0]
+        return _images.get((ref,) + pageKey + sizes[0] + (None,))
 
 
-def generate(page):
-    """Schedule an image to be generated for the cache."""
-    # Poppler-Qt4 crashes when different pages from a Document are rendered at the same time,
-    # so we schedule them to be run in sequence.
-    document = page.document()
+def tiled(page):
+    """Returns True if the Page at its current size is rendered in tiles."""
+    return page.width() * page.height() > tilethreshold
+
+
+def tiles(page, rect=None):
+    """Returns a list of (x, y) tuples for the tiles of the Page touching rect.
+    
+    The rect is relative to the page. If not given, all tiles are returned.
+    
+    """
+    if rect is None:
+        rect = QRect(0, 0, page.width(), page.height())
+    else:
+        rect = rect & QRect(0, 0, page.width(), page.height())
+        if not rect:
+            return []
+    return [(x, y)
+        for y in range(rect.top() // tilesize, rect.bottom() // tilesize + 1)
+        for x in range(rect.left() // tilesize, rect.right() // tilesize + 1)]
+
+
+def tilerect(page, tile):
+    """Returns the QRect of the (x, y) tile, relative to the Page."""
+    x, y = tile[0] * tilesize, tile[1] * tilesize
+    return QRect(x, y, min(tilesize, page.width() - x), min(tilesize, page.height() - y))
+
+
+def tile(page, tile):
+    """Returns the rendered image for the (x, y) tile of the Page if in cache."""
+    global _misses
     try:
-        scheduler = _schedulers[document]
+        ref = _refs[page.document()]
+    except KeyError:
+        _misses += 1
+        return
+    return _lookup((ref, page.pageNumber(), page.rotation(),
+                    page.width(), page.height(), tile))
+
+
+def setsource(document, data):
+    """Registers the data (a QByteArray) the Poppler.Document was loaded from.
+    
+    The pages of such a document are rendered in parallel, every thread using
+    its own copy of the document, loaded from the same data. Pages of other
+    documents are rendered one at a time.
+    
+    """
+    _sources[document] = data
+
+
+def reuse(olddocument, newdocument):
+    """Copies the images and links of unchanged pages to the new document.
+    
+    Both documents must have been registered with setsource(). The pages are
+    compared using a hash of their contents, which is computed in a background
+    thread; images are copied for all pages that look the same, links only if
+    the link annotations are the same too. Pages of the new document that are
+    waiting for an image are updated when images are copied.
+    
+    """
+    if (olddocument in _refs and olddocument in _sources
+        and newdocument in _sources):
+        HashRunner(olddocument, newdocument)
+
+
+def _reuse(olddocument, newdocument):
+    """(Internal) Copies the images and links of unchanged pages, see reuse()."""
+    old, new = _hashes.get(olddocument), _hashes.get(newdocument)
+    if not old or not new or olddocument not in _refs:
+        return
+    oldpages = {}
+    for num, (contents, annots) in enumerate(old):
+        oldpages.setdefault(contents, num)
+    newpages = {}   # old page number: list of new page numbers
+    for num, (contents, annots) in enumerate(new):
+        try:
+            newpages.setdefault(oldpages[contents], []).append(num)
+        except KeyError:
+            pass
+    oldref = _refs[olddocument]
+    for key, image in [(key, image) for key, image in _images.items()
+                       if key[0] is oldref and key[1] in newpages]:
+        for num in newpages[key[1]]:
+            add(image, newdocument, num, *key[2:])
+    oldlinks = _links.get(olddocument, {})
+    for oldnum, nums in newpages.items():
+        if oldnum in oldlinks:
+            for num in nums:
+                if old[oldnum][1] == new[num][1]:
+                    _links.setdefault(newdocument, {})[num] = oldlinks[oldnum]
+    scheduler = _schedulers.get(newdocument)
+    if scheduler:
+        scheduler.reused(set(num for nums in newpages.values() for num in nums))
+
+
+def previewsize(page):
+    """Returns the (width, height) of the preview of the Page, at previewdpi."""
+    size = page.pageSize()
+    return (int(round(size.width() * previewdpi / 72.0)),
+            int(round(size.height() * previewdpi / 72.0)))
+
+
+def generate(page, tiles=None, prefetch=False, preview=False):
+    """Schedule an image to be generated for the cache.
+    
+    If tiles is given, it is a list of (x, y) tiles to render instead of the
+    whole page. If prefetch is True, the image is rendered after all other
+    requested images. If preview is True, a low resolution preview of the page
+    is rendered first, unless the page is not larger than the preview itself.
+    
+    """
+    if preview and previewsize(page)[0] >= page.width():
+        preview = False
+    _scheduler(page.document()).schedulejob(page, tiles, prefetch, preview)
+
+
+def generatepreviews(pages):
+    """Schedule previews to be generated for the pages that have no image yet.
+    
+    The previews are rendered after all other requested images, in the order
+    of the pages.
+    
+    """
+    for page in pages:
+        if not image(page, False) and previewsize(page)[0] < page.width():
+            _scheduler(page.document()).schedulejob(page, [], True, True)
+
+
+def _scheduler(document):
+    """(Internal) Returns the Scheduler for the document, creating it if needed."""
+    try:
+        return _schedulers[document]
     except KeyError:
         scheduler = _schedulers[document] = Scheduler()
-    scheduler.schedulejob(page)
+        return scheduler
 
 
-def add(image, document, pageNumber, rotation, width, height):
+def add(image, document, pageNumber, rotation, width, height, tile=None):
     """(Internal) Adds an image to the cache."""
-    pageKey = (pageNumber, rotation)
-    sizeKey = (width, height)
-    _cache.setdefault(document, {}).setdefault(pageKey, {})[sizeKey] = [image, time.time()]
+    global _currentsize
+    key = (_docref(document), pageNumber, rotation, width, height, tile)
+    try:
+        _currentsize -= _images.pop(key).byteCount()
+    except KeyError:
+        pass
+    _images[key] = image
+    _currentsize += image.byteCount()
+    if tile is None:
+        _sizes.setdefault(document, {}).setdefault(
+            (pageNumber, rotation), set()).add((width, height))
     
     # maintain cache size
-    global _maxsize, _currentsize
-    _currentsize += image.byteCount()
     if _currentsize > _maxsize:
         purge()
 
 
 def purge():
-    """Removes old images from the cache to limit the space used.
+    """Removes the least recently used images from the cache to limit the space used.
     
     (Not necessary to call, as the cache will monitor its size automatically.)
     
     """
-    # make a list of the images, sorted on time, newest first
-    images = iter(sorted((
-        (time, document, pageKey, sizeKey, image.byteCount())
-            for document, pageKeys in _cache.items()
-            for pageKey, sizeKeys in pageKeys.items()
-            for sizeKey, (image, time) in sizeKeys.items()),
-                reverse=True))
-
-    # sum the size of the newest images
-    global _maxsize, _currentsize
-    byteCount = 0
-    for item in images:
-        byteCount += item[4]
-        if byteCount > _maxsize:
-            break
-    _currentsize = byteCount
-    # delete the other images
-    for time, document, pageKey, sizeKey, byteCount in images:
-        del _cache[document][pageKey][sizeKey]
+    global _currentsize, _evictions
+    while _currentsize > _maxsize and _images:
+        key, image = _images.popitem(False)
+        _currentsize -= image.byteCount()
+        _evictions += 1
+        if key[5] is None:
+            document = key[0]()
+            try:
+                sizes = _sizes[document][key[1:3]]
+            except (KeyError, TypeError):
+                continue
+            sizes.discard(key[3:5])
+            if not sizes:
+                del _sizes[document][key[1:3]]
 
 
 def links(page):
@@ -208,91 +440,237 @@ def setoptions(options, document=None):
 
 
 class Scheduler(object):
-    """Manages running rendering jobs in sequence for a Document."""
+    """Manages running rendering jobs for a Document.
+    
+    If the source of the document is known (see setsource()), at most
+    maxthreads jobs run at the same time, each in its own copy of the
+    document. Otherwise the jobs are run in sequence, because Poppler-Qt4
+    crashes when different pages from a Document are rendered at the same time.
+    
+    """
     def __init__(self):
-        self._schedule = []     # order
+        self._schedule = []     # order (the most urgent job last)
         self._jobs = {}         # jobs on key
         self._waiting = weakref.WeakKeyDictionary()      # jobs on page
-        self._running = None
+        self._running = {}      # Runner on job
+        self._instances = []    # idle copies of the document
         
-    def schedulejob(self, page):
-        """Creates or retriggers an existing Job.
+    def schedulejob(self, page, tiles=None, prefetch=False, preview=False):
+        """Creates or retriggers existing Jobs.
         
-        If a Job was already scheduled for the page, it is canceled.
-        The page's update() method will be called when the Job has completed.
+        Jobs that were already scheduled for the page remain wanted, unless
+        they are for another size or rotation of the page than the current.
+        If tiles is given, a Job is created for every tile in the list.
+        If prefetch is True, the Jobs are run after the other waiting Jobs.
+        If preview is True, a Job rendering a preview of the page is run before
+        the other Jobs; if tiles is an empty list, only the preview is rendered.
+        The page's update() method will be called when a Job has completed.
         
         """
-        # uniquely identify the image to be generated
-        key = (page.pageNumber(), page.rotation(), page.width(), page.height())
-        try:
-            job = self._jobs[key]
-        except KeyError:
-            job = self._jobs[key] = Job(page)
-            job.key = key
-        else:
-            self._schedule.remove(job)
-        self._schedule.append(job)
-        self._waiting[page] = job
+        specs = [(page.width(), page.height(), tile)
+                 for tile in ((None,) if tiles is None else tiles)]
+        if preview:
+            specs.append(previewsize(page) + (None,))
+        jobs = []
+        for width, height, tile in specs:
+            # uniquely identify the image to be generated
+            key = (page.pageNumber(), page.rotation(), width, height, tile)
+            try:
+                job = self._jobs[key]
+            except KeyError:
+                job = self._jobs[key] = Job(page, tile, (width, height))
+                job.key = key
+            else:
+                if job in self._running:
+                    jobs.append(job)
+                    continue
+                self._schedule.remove(job)
+            if prefetch:
+                self._schedule.insert(0, job)
+            else:
+                self._schedule.append(job)
+            jobs.append(job)
+        for job in self._waiting.get(page, ()):
+            if job not in jobs and self.matches(page, job):
+                jobs.append(job)
+        self._waiting[page] = jobs
         self.checkStart()
         
+    def maxrunning(self, document):
+        """Returns how many jobs for the document may run at the same time."""
+        return maxthreads if document in _sources else 1
+    
+    def wanted(self, job):
+        """Returns True if a page still waits for the job.
+        
+        A job is not wanted anymore when the page has a different size or
+        rotation now, e.g. because the view was zoomed. (Previews are always
+        wanted as long as the rotation is the same.)
+        
+        """
+        for page, jobs in self._waiting.items():
+            if job in jobs and self.matches(page, job):
+                return True
+        return False
+    
+    def matches(self, page, job):
+        """Returns True if the job renders the page at its current size and rotation.
+        
+        Previews match as long as the rotation is the same.
+        
+        """
+        return (page.rotation() == job.rotation
+                and (job.preview or (page.width() == job.width
+                                     and page.height() == job.height)))
+    
     def checkStart(self):
-        """Starts a job if none is running and at least one is waiting."""
-        while self._schedule and not self._running:
+        """Starts jobs while there is room for them and jobs are waiting."""
+        while self._schedule and len(_runners) < maxthreads:
             job = self._schedule[-1]
             document = job.document()
-            if document and job in self._waiting.values():
-                self._running = Runner(self, document, job)
-                break
-            else:
+            if not document or not self.wanted(job):
+                del self._jobs[job.key]
+                self._schedule.pop()
                 self.done(job)
+            elif len(self._running) < self.maxrunning(document):
+                self._schedule.pop()
+                instance = self._instances.pop() if self._instances else None
+                self._running[job] = Runner(self, document, job, instance)
+            else:
+                break
             
+    def reused(self, pageNumbers):
+        """Called when images were copied for the pages with the numbers.
+        
+        Those pages are updated, and the jobs they are waiting for are not
+        wanted anymore if their images are in the cache now. Previews are not
+        wanted anymore if any image of the page is in the cache now.
+        
+        """
+        for page in list(self._waiting):
+            if page.pageNumber() in pageNumbers:
+                ref = _refs.get(page.document())
+                cached = image(page, False) is not None
+                jobs = self._waiting[page]
+                jobs[:] = [job for job in jobs if job in self._running
+                           or not (job.preview and cached)
+                              and (ref,) + job.key not in _images]
+                if not jobs:
+                    del self._waiting[page]
+                page.update()
+        self.checkStart()
+    
     def done(self, job):
-        """Called when the job has completed."""
-        del self._jobs[job.key]
-        self._schedule.remove(job)
-        self._running = None
+        """Called when the job has completed (or was canceled)."""
+        try:
+            runner = self._running.pop(job)
+        except KeyError:
+            pass
+        else:
+            del self._jobs[job.key]
+            if runner.instance:
+                self._instances.append(runner.instance)
         for page in list(self._waiting):
-            if self._waiting[page] is job:
+            jobs = self._waiting[page]
+            if job in jobs:
                 page.update()
-                del self._waiting[page]
+                jobs.remove(job)
+                if not jobs:
+                    del self._waiting[page]
 
 
 class Job(object):
-    """Simply contains data needed to create an image later."""
-    def __init__(self, page):
+    """Simply contains data needed to create an image later.
+    
+    The size is the (width, height) to render the page at, by default the
+    current size of the page. If it differs, the Job renders a preview.
+    
+    """
+    def __init__(self, page, tile=None, size=None):
         self.document = weakref.ref(page.document())
         self.pageNumber = page.pageNumber()
         self.rotation = page.rotation()
-        self.width = page.width()
-        self.height = page.height()
+        self.width, self.height = size or (page.width(), page.height())
+        self.preview = (self.width, self.height) != (page.width(), page.height())
+        self.tile = tile
+        self.rect = tilerect(page, tile) if tile else QRect(0, 0, self.width, self.height)
+
+
+class HashRunner(QThread):
+    """Computes the page hashes of two documents in a background thread.
+    
+    When finished, the images of the pages that did not change are copied
+    from the old document to the new one. Hashes already computed for a
+    document are reused.
+    
+    """
+    def __init__(self, olddocument, newdocument):
+        super(HashRunner, self).__init__()
+        self.documents = olddocument, newdocument # keep them alive during this thread
+        self.sources = [_sources[doc] for doc in self.documents]
+        self.hashes = [_hashes.get(doc, False) for doc in self.documents]
+        self.finished.connect(self.slotFinished)
+        _hashrunners.add(self)
+        self.start()
+    
+    def run(self):
+        """Main method of this thread, called by Qt on start()."""
+        for i, source in enumerate(self.sources):
+            if self.hashes[i] is False:
+                self.hashes[i] = contenthash.pagehashes(bytes(source))
+    
+    def slotFinished(self):
+        """Called when the thread has completed."""
+        _hashrunners.discard(self)
+        for document, hashes in zip(self.documents, self.hashes):
+            if hashes and len(hashes) != document.numPages():
+                hashes = None
+            _hashes[document] = hashes
+        _reuse(*self.documents)
 
 
 class Runner(QThread):
-    """Immediately runs a Job in a background thread."""
-    def __init__(self, scheduler, document, job):
+    """Immediately runs a Job in a background thread.
+    
+    If instance is given or the source of the document is known, the page is
+    rendered using that copy of the document, which is loaded in the thread if
+    needed.
+    
+    """
+    def __init__(self, scheduler, document, job, instance=None):
         super(Runner, self).__init__()
         self.scheduler = scheduler
         self.job = job
         self.document = document # keep reference now so that it does not die during this thread
+        self.instance = instance
+        self.source = _sources.get(document)
         self.finished.connect(self.slotFinished)
+        _runners.add(self)
         self.start()
         
     def run(self):
         """Main method of this thread, called by Qt on start()."""
-        page = self.document.page(self.job.pageNumber)
+        if not self.instance and self.source is not None:
+            self.instance = popplerqt4.Poppler.Document.loadFromData(self.source) or None
+        document = self.instance or self.document
+        page = document.page(self.job.pageNumber)
         pageSize = page.pageSize()
         if self.job.rotation & 1:
             pageSize.transpose()
         xres = 72.0 * self.job.width / pageSize.width()
         yres = 72.0 * self.job.height / pageSize.height()
-        with lock(self.document):
-            options().write(self.document)
-            options(self.document).write(self.document)
-            self.image = page.renderToImage(xres, yres, 0, 0, self.job.width, self.job.height, self.job.rotation)
+        x, y, w, h = self.job.rect.getRect()
+        with lock(document):
+            options().write(document)
+            options(self.document).write(document)
+            self.image = page.renderToImage(xres, yres, x, y, w, h, self.job.rotation)
         
     def slotFinished(self):
         """Called when the thread has completed."""
-        add(self.image, self.document, self.job.pageNumber, self.job.rotation, self.job.width, self.job.height)
+        _runners.discard(self)
+        add(self.image, self.document, self.job.pageNumber, self.job.rotation,
+            self.job.width, self.job.height, self.job.tile)
         self.scheduler.done(self.job)
-        self.scheduler.checkStart()
-
+        # there is room for another job, maybe for another document
+        for scheduler in [self.scheduler] + list(_schedulers.values()):
+            scheduler.checkStart()
@@ -0,0 +1,294 @@
+# This file is part of the qpopplerview package.
+#
+# Copyright (c) 2010 - 2012 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+
+"""
+Computes hashes of the contents of the pages of a PDF file.
+
+Poppler does not give access to the content streams of the pages, so this
+module reads the PDF data itself, just enough to find the pages in order and
+their content streams, resources and annotations.
+
+The hash of a page covers its size and rotation, its content streams and the
+names in its resources dictionary, for fonts the base font name without the
+subset prefix. Object numbers may change between two versions of a document,
+so they are not hashed, and the objects the resources refer to (font files,
+images) are not hashed either: a page is considered unchanged if it draws the
+same with resources of the same names.
+
+The cost is one pass over the PDF data to find the objects, plus hashing the
+content streams of the pages; objects in compressed object streams are
+decompressed once. This is best done in a background thread.
+
+"""
+
+import hashlib
+import re
+import zlib
+
+
+_obj_re = re.compile(br'(\d+)\s+\d+\s+obj\b')
+_ref_re = re.compile(br'(\d+)\s+\d+\s+R\b')
+_length_re = re.compile(br'/Length\s+(\d+)\b(?!\s+\d+\s+R)')
+_subset_re = re.compile(br'/[A-Z]{6}\+')
+
+
+def pagehashes(data):
+    """Returns a list with a (contents, annotations) tuple for every page.
+
+    Both are strings with a hash, the first of everything that determines how
+    a page looks, the second of the link annotations of the page.
+    Returns None if the page tree could not be found in the data.
+
+    """
+    objects = _objects(data)
+    pages = []
+    for num, (dictionary, stream) in objects.items():
+        if (_value(dictionary, b'/Type') == b'/Pages'
+            and _value(dictionary, b'/Parent') is None):
+            _pages(objects, num, pages, set())
+            break
+    if not pages:
+        return
+    result = []
+    for dictionary in pages:
+        contents = hashlib.sha1()
+        for key in (b'/MediaBox', b'/CropBox', b'/Rotate'):
+            contents.update(key + (_value(dictionary, key) or b''))
+        for num in _refs(objects, _value(dictionary, b'/Contents')):
+            contents.update(objects.get(num, (b'', b''))[1])
+        _hashresources(objects, _value(dictionary, b'/Resources'), contents)
+        annots = hashlib.sha1()
+        for num in _refs(objects, _value(dictionary, b'/Annots')):
+            annot = objects.get(num, (b'', b''))[0]
+            annots.update(_ref_re.sub(b'R', _value(annot, b'/Rect') or b''))
+            action = _value(annot, b'/A') or b''
+            for ref in _ref_re.findall(action):
+                action = objects.get(int(ref), (b'', b''))[0]
+            annots.update(_ref_re.sub(b'R', action))
+        result.append((contents.hexdigest(), annots.hexdigest()))
+    return result
+
+
+def _objects(data):
+    """(Internal) Returns a dict mapping object number to (dictionary, stream).
+
+    Later objects with the same number (from incremental updates) replace the
+    earlier ones. The objects in object streams are also read.
+
+    """
+    objects = {}
+    pos = 0
+    while True:
+        m = _obj_re.search(data, pos)
+        if not m:
+            break
+        end = data.find(b'endobj', m.end())
+        if end == -1:
+            break
+        stream = b''
+        start = data.find(b'stream', m.end(), end)
+        if start == -1:
+            dictionary = data[m.end():end]
+        else:
+            dictionary = data[m.end():start]
+            start += 6
+            if data[start:start+2] == b'\r\n':
+                start += 2
+            elif data[start:start+1] in (b'\n', b'\r'):
+                start += 1
+            length = _length_re.search(dictionary)
+            if length:
+                stop = start + int(length.group(1))
+            else:
+                stop = data.find(b'endstream', start)
+            stream = data[start:stop]
+            end = data.find(b'endobj', stop)
+            if end == -1:
+                break
+        objects[int(m.group(1))] = (dictionary, stream)
+        pos = end + 6
+    for dictionary, stream in list(objects.values()):
+        if _value(dictionary, b'/Type') == b'/ObjStm':
+            _objectstream(dictionary, stream, objects)
+    return objects
+
+
+def _objectstream(dictionary, stream, objects):
+    """(Internal) Adds the objects in the compressed object stream to objects.
+
+    Objects that were already found outside object streams are not replaced.
+
+    """
+    if _value(dictionary, b'/Filter') not in (b'/FlateDecode', b'[/FlateDecode]'):
+        return
+    try:
+        data = zlib.decompress(stream)
+        count = int(_value(dictionary, b'/N'))
+        first = int(_value(dictionary, b'/First'))
+    except (zlib.error, TypeError, ValueError):
+        return
+    numbers = [int(n) for n in data[:first].split()[:count*2]]
+    offsets = [first + offset for offset in numbers[1::2]] + [len(data)]
+    for num, start, end in zip(numbers[::2], offsets, offsets[1:]):
+        objects.setdefault(num, (data[start:end], b''))
+
+
+def _pages(objects, num, pages, seen):
+    """(Internal) Appends the page dictionaries of the (sub)tree num to pages."""
+    if num in seen or num not in objects:
+        return
+    seen.add(num)
+    dictionary = objects[num][0]
+    kids = _value(dictionary, b'/Kids')
+    if kids is None:
+        pages.append(dictionary)
+    else:
+        for kid in _refs(objects, kids):
+            _pages(objects, kid, pages, seen)
+
+
+def _refs(objects, value):
+    """(Internal) Returns the object numbers referred to by the value.
+
+    If the value is a single reference to an array, the references in that
+    array are returned.
+
+    """
+    if not value:
+        return []
+    refs = [int(n) for n in _ref_re.findall(value)]
+    if len(refs) == 1 and not value.startswith(b'['):
+        array = objects.get(refs[0], (b'', b''))[0].strip()
+        if array.startswith(b'['):
+            return [int(n) for n in _ref_re.findall(array)]
+    return refs
+
+
+def _hashresources(objects, value, h):
+    """(Internal) Updates the hash h with the names in the resources dictionary value.
+
+    Only the names are hashed, and for fonts the base font name without the
+    subset prefix; the objects the resources refer to are not.
+
+    """
+    if value is None:
+        return
+    refs = _ref_re.findall(value)
+    if len(refs) == 1 and not value.startswith(b'<<'):
+        value = objects.get(int(refs[0]), (b'', b''))[0]
+    h.update(_ref_re.sub(b'R', value))
+    for category in (b'/Font', b'/XObject', b'/ExtGState', b'/ColorSpace',
+                     b'/Pattern', b'/Shading'):
+        entries = _value(value, category)
+        if entries is None:
+            continue
+        refs = _ref_re.findall(entries)
+        if len(refs) == 1 and not entries.startswith(b'<<'):
+            entries = objects.get(int(refs[0]), (b'', b''))[0]
+        h.update(_ref_re.sub(b'R', entries))
+        if category == b'/Font':
+            for ref in _ref_re.findall(entries):
+                font = objects.get(int(ref), (b'', b''))[0]
+                h.update(_subset_re.sub(b'/', _value(font, b'/BaseFont') or b''))
+
+
+def _value(dictionary, key):
+    """(Internal) Returns the raw value of the key in the dictionary text, or None.
+
+    Only the outermost level of the dictionary is searched.
+
+    """
+    depth = 0
+    i = dictionary.find(b'<<')
+    if i == -1:
+        return
+    i += 2
+    length = len(dictionary)
+    while i < length:
+        if dictionary.startswith(b'<<', i):
+            depth += 1
+            i += 2
+        elif dictionary.startswith(b'>>', i):
+            if depth == 0:
+                return
+            depth -= 1
+            i += 2
+        elif dictionary[i:i+1] == b'(':
+            i = _skipstring(dictionary, i)
+        elif depth == 0 and dictionary.startswith(key, i):
+            end = i + len(key)
+            if dictionary[end:end+1].isalnum():
+                i = end
+                continue
+            return _rawvalue(dictionary, end)
+        else:
+            i += 1
+
+
+def _rawvalue(text, i):
+    """(Internal) Returns the text of the PDF value starting at (or after) i."""
+    length = len(text)
+    while i < length and text[i:i+1].isspace():
+        i += 1
+    start = i
+    if text.startswith(b'<<', i) or text[i:i+1] == b'[':
+        depth = 0
+        while i < length:
+            if text.startswith(b'<<', i) or text[i:i+1] == b'[':
+                depth += 1
+                i += 2 if text[i:i+1] == b'<' else 1
+            elif text.startswith(b'>>', i) or text[i:i+1] == b']':
+                depth -= 1
+                i += 2 if text[i:i+1] == b'>' else 1
+                if depth == 0:
+                    break
+            elif text[i:i+1] == b'(':
+                i = _skipstring(text, i)
+            else:
+                i += 1
+        return text[start:i]
+    if text[i:i+1] == b'(':
+        return text[start:_skipstring(text, i)]
+    m = _ref_re.match(text, i)
+    if m:
+        return m.group()
+    i += 1
+    while i < length and text[i:i+1] not in b'/<>[]()' and not text[i:i+1].isspace():
+        i += 1
+    return text[start:i]
+
+
+def _skipstring(text, i):
+    """(Internal) Returns the position after the PDF string starting at i."""
+    depth = 0
+    length = len(text)
+    while i < length:
+        c = text[i:i+1]
+        if c == b'\\':
+            i += 2
+            continue
+        elif c == b'(':
+            depth += 1
+        elif c == b')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
@@ -45,7 +45,13 @@ class Page(object):
     can be set to False to hide the page from a Surface (this is done by
     the Layout).
     
+    When the page is large enough to be rendered in tiles (see the cache
+    module), only the tiles that need to be painted are rendered, plus the
+    tiles within prefetchMargin pixels around them.
+    
     """
+    prefetchMargin = 256
+    
     def __init__(self, document, pageNumber):
         self._document = document
         self._pageNumber = pageNumber
@@ -158,28 +164,73 @@ class Page(object):
         update_rect = rect & self.rect()
         if not update_rect:
             return
+        if cache.tiled(self):
+            return self.paintTiles(painter, update_rect)
         image_rect = QRect(update_rect.topLeft() - self.rect().topLeft(), update_rect.size())
         image = cache.image(self)
         self._waiting = not image
         if image:
             painter.drawImage(update_rect, image, image_rect)
         else:
-            # schedule an image to be generated, if done our update() method is called
-            cache.generate(self)
-            # find suitable image to be scaled from other size
-            image = cache.image(self, False)
+            # schedule an image to be generated, if done our update() method is called;
+            # if there is nothing to show meanwhile, a preview is rendered first
+            cache.generate(self, preview=not self.paintFallback(painter, update_rect))
+    
+    def paintTiles(self, painter, update_rect):
+        """Paints the update_rect using tiles, rendering the missing ones.
+        
+        Besides the missing tiles in update_rect, also the tiles within
+        prefetchMargin pixels around it are rendered.
+        
+        """
+        offset = self.rect().topLeft()
+        page_rect = update_rect.translated(-offset)
+        missing = []
+        preview = False
+        for tile in cache.tiles(self, page_rect):
+            tile_rect = cache.tilerect(self, tile)
+            image = cache.tile(self, tile)
+            paint_rect = tile_rect & page_rect
             if image:
-                hscale = float(image.width()) / self.width()
-                vscale = float(image.height()) / self.height()
-                image_rect = QRectF(image_rect.x() * hscale, image_rect.y() * vscale,
-                                    image_rect.width() * hscale, image_rect.height() * vscale)
-                painter.drawImage(QRectF(update_rect), image, image_rect)
+                painter.drawImage(paint_rect.translated(offset), image,
+                                  paint_rect.translated(-tile_rect.topLeft()))
             else:
-                # draw blank paper, using the background color of the cache rendering (if set)
-                # or from the document itself.
-                color = (cache.options(self.document()).paperColor()
-                         or cache.options().paperColor() or self.document().paperColor())
-                painter.fillRect(update_rect, color)
+                missing.append(tile)
+                if not self.paintFallback(painter, paint_rect.translated(offset)):
+                    preview = True
+        self._waiting = bool(missing)
+        m = self.prefetchMargin
+        for tile in cache.tiles(self, page_rect.adjusted(-m, -m, m, m)):
+            if tile not in missing and not cache.tile(self, tile):
+                missing.insert(0, tile)
+        if missing:
+            # schedule the tiles to be generated, if done our update() method is called
+            cache.generate(self, missing, preview=preview)
+    
+    def paintFallback(self, painter, update_rect):
+        """Paints the update_rect while the correctly sized image is not yet available.
+        
+        Returns True if an image of another size (e.g. a preview) was painted,
+        False if only blank paper could be painted.
+        
+        """
+        image_rect = QRect(update_rect.topLeft() - self.rect().topLeft(), update_rect.size())
+        # find suitable image to be scaled from other size
+        image = cache.image(self, False)
+        if image:
+            hscale = float(image.width()) / self.width()
+            vscale = float(image.height()) / self.height()
+            image_rect = QRectF(image_rect.x() * hscale, image_rect.y() * vscale,
+                                image_rect.width() * hscale, image_rect.height() * vscale)
+            painter.drawImage(QRectF(update_rect), image, image_rect)
+            return True
+        else:
+            # draw blank paper, using the background color of the cache rendering (if set)
+            # or from the document itself.
+            color = (cache.options(self.document()).paperColor()
+                     or cache.options().paperColor() or self.document().paperColor())
+            painter.fillRect(update_rect, color)
+            return False
 
     def update(self):
         """Called when an image is drawn."""
@@ -190,7 +241,11 @@ class Page(object):
     def repaint(self):
         """Call this to force a repaint (e.g. when the rendering options are changed)."""
         self._waiting = True
-        cache.generate(self)
+        if cache.tiled(self):
+            # paint() will request the needed tiles
+            self.update()
+        else:
+            cache.generate(self)
     
     def image(self, rect, xdpi=72.0, ydpi=None, options=None):
         """Returns a QImage of the specified rectangle (relative to our layout).
@@ -231,6 +231,7 @@ class Surface(QWidget):
         self.clearSelection()
         self.resize(self._pageLayout.size())
         self.update()
+        self.view().schedulePrefetch()
         
     def highlight(self, highlighter, areas, msec=0):
         """Highlights the list of areas using the given highlighter.
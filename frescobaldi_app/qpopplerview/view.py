@@ -64,6 +64,9 @@ class View(KineticScrollArea):
         self._centerPos = False
         self._resizeTimer = QTimer(singleShot = True, timeout = self._resizeTimeout)
         
+        # delayed prefetching of the pages around the visible ones
+        self._prefetchTimer = QTimer(singleShot = True, timeout = self.prefetch)
+        
     def surface(self):
         """Returns our Surface, the widget drawing the page(s)."""
         sf = self.widget()
@@ -127,6 +130,10 @@ class View(KineticScrollArea):
         if self.viewMode():
             self.fit()
         self.surface().pageLayout().update()
+        # render previews in the background of the pages that have no image yet;
+        # previews of pages that get the images of an unchanged page of the
+        # previous version of the document are dropped again, see cache.reuse()
+        cache.generatepreviews(list(self.surface().pageLayout().pages()))
 
     def clear(self):
         """Convenience method to clear the current layout."""
@@ -150,6 +157,39 @@ class View(KineticScrollArea):
         rect.intersect(self.surface().rect())
         return self.surface().pageLayout().pagesAt(rect)
 
+    def prefetch(self):
+        """Schedules images to be rendered for the pages just outside the viewport.
+        
+        The pages in the screenful before and after the visible part of the
+        surface are rendered after the visible ones. Pages that are rendered
+        in tiles are not prefetched.
+        
+        This is called shortly after the view has been scrolled or the layout
+        has changed (e.g. by zooming), see schedulePrefetch().
+        
+        """
+        rect = self.viewport().rect()
+        rect.translate(-self.surface().pos())
+        visible = set(self.surface().pageLayout().pagesAt(rect))
+        rect.adjust(-rect.width(), -rect.height(), rect.width(), rect.height())
+        rect.intersect(self.surface().rect())
+        for page in self.surface().pageLayout().pagesAt(rect):
+            if page not in visible and not cache.tiled(page) and not cache.image(page):
+                cache.generate(page, prefetch=True)
+    
+    def schedulePrefetch(self):
+        """Calls prefetch() after a short delay.
+        
+        While scrolling, prefetch() is called at most every 100 msec.
+        
+        """
+        if not self._prefetchTimer.isActive():
+            self._prefetchTimer.start(100)
+    
+    def scrollContentsBy(self, dx, dy):
+        super(View, self).scrollContentsBy(dx, dy)
+        self.schedulePrefetch()
+        
     def redraw(self):
         """Redraws, e.g. when you changed rendering hints or papercolor on the document."""
         pages = list(self.visiblePages())
@@ -24,10 +24,12 @@ Widget for search and replace.
 from __future__ import unicode_literals
 
 import bisect
+import itertools
 import re
 import weakref
+from array import array
 
-from PyQt4.QtCore import Qt
+from PyQt4.QtCore import Qt, QTimer
 from PyQt4.QtGui import (
     QAction, QApplication, QCheckBox, QGridLayout, QKeySequence, QLabel,
     QLineEdit, QPalette, QPushButton, QStyle, QTextCursor, QToolButton, QWidget)
@@ -35,7 +37,6 @@ from PyQt4.QtGui import (
 import app
 import qutil
 import plugin
-import cursortools
 import textformats
 import viewhighlighter
 import widgets.borderlayout
@@ -45,7 +46,16 @@ class Search(QWidget, plugin.MainWindowPlugin):
     def __init__(self, mainwindow):
         super(Search, self).__init__(mainwindow)
         self._currentView = None
-        self._positions = None
+        self._starts = array(str('i'))  # start positions of the matches
+        self._ends = array(str('i'))    # end positions of the matches
+        self._regex = None      # the compiled search text
+        self._matches = None    # iterator over the matches not yet found
+        self._changed = None    # position where the document changed since the search
+        self._wrapPrevious = False  # jump to the last match when all are found
+        self._visible = None    # range of the highlighted matches
+        self._searchTimer = QTimer(timeout=self.slotSearchTimeout)
+        self._restartTimer = QTimer(singleShot=True, interval=100,
+                                    timeout=self.restartSearch)
         self._replace = False  # are we in replace mode?
         
         mainwindow.currentViewChanged.connect(self.viewChanged)
@@ -123,7 +133,16 @@ class Search(QWidget, plugin.MainWindowPlugin):
         return self._currentView and self._currentView()
     
     def setCurrentView(self, view):
+        old = self.currentView()
+        if view is old:
+            return
+        if old:
+            old.updateRequest.disconnect(self.slotUpdateRequest)
+            old.document().contentsChange.disconnect(self.slotDocumentChanged)
         self._currentView = weakref.ref(view) if view else None
+        if view:
+            view.updateRequest.connect(self.slotUpdateRequest)
+            view.document().contentsChange.connect(self.slotDocumentChanged)
         
     def showWidget(self):
         if self.isVisible():
@@ -138,6 +157,7 @@ class Search(QWidget, plugin.MainWindowPlugin):
         view = self.currentView()
         if view:
             viewhighlighter.highlighter(view).clear("search")
+            self._visible = None
             self.hide()
             layout = widgets.borderlayout.BorderLayout.get(view)
             layout.removeWidget(self)
@@ -146,7 +166,7 @@ class Search(QWidget, plugin.MainWindowPlugin):
         self.setParent(None)
         self.hideWidget()
         self.setCurrentView(new)
-        self.updatePositions()
+        self.startSearch()
         
     def slotHide(self):
         view = self.currentView()
@@ -193,51 +213,157 @@ class Search(QWidget, plugin.MainWindowPlugin):
         focus.setFocus()
         
     def slotSearchChanged(self):
-        self.updatePositions()
-        viewhighlighter.highlighter(self.currentView()).highlight("search", self._positions, 1)
+        self.startSearch()
 
-    def updatePositions(self):
+    def startSearch(self):
+        """Starts finding the matches of the search text in the current view.
+        
+        The matches are found in the background, in batches. Their start and
+        end positions are stored in arrays, and only the matches that are
+        visible in the view are highlighted.
+        
+        """
+        self._regex = None
+        self._wrapPrevious = False
         search = self.searchEntry.text()
-        view = self.currentView()
-        document = view.document()
-        self._positions = []
         if search:
-            text = document.toPlainText()
             flags = re.MULTILINE | re.DOTALL
             if not self.caseCheck.isChecked():
                 flags |= re.IGNORECASE
             if not self.regexCheck.isChecked():
                 search = re.escape(search)
             try:
-                matches = re.finditer(search, text, flags)
+                self._regex = re.compile(search, flags)
             except re.error:
                 pass
-            else:
-                for m in matches:
-                    c = QTextCursor(document)
-                    c.setPosition(m.end())
-                    c.setPosition(m.start(), QTextCursor.KeepAnchor)
-                    self._positions.append(c)
-        self.countLabel.setText(unicode(len(self._positions)))
+        self._changed = 0
+        self.restartSearch()
+    
+    def restartSearch(self):
+        """Finds the matches again from the position where the document changed.
+        
+        For a plain text search, the matches that end before that position
+        are kept and the search continues after them. A regular expression
+        search starts again from the beginning, because a change can affect
+        its earlier matches.
+        
+        """
+        self._restartTimer.stop()
+        self._searchTimer.stop()
+        position = 0 if self.regexCheck.isChecked() else self._changed
+        self._changed = None
+        index = bisect.bisect_right(self._ends, position)
+        del self._starts[index:]
+        del self._ends[index:]
+        self._matches = None
+        self._visible = None
+        view = self.currentView()
+        if view and self._regex:
+            start = self._ends[-1] if self._ends else 0
+            self._matches = self._regex.finditer(view.document().toPlainText(), start)
+            self._searchTimer.start()
+        self.updateCount()
+        self.updateHighlighting()
+    
+    def findMatches(self, count=None):
+        """Finds at most count more matches, or all remaining if count is None."""
+        if self._changed is not None:
+            self.restartSearch()
+        if not self._matches:
+            return
+        starts, ends = self._starts, self._ends
+        found = len(starts)
+        for m in itertools.islice(self._matches, count):
+            starts.append(m.start())
+            ends.append(m.end())
+        if count is None or len(starts) - found < count:
+            self._matches = None
+            self._searchTimer.stop()
+        self.updateCount()
+        self.updateHighlighting()
+        if not self._matches and self._wrapPrevious:
+            self.findPrevious()
+    
+    def findMatchesUntil(self, position):
+        """Finds matches until one starts after position, or all are found."""
+        if self._changed is not None:
+            self.restartSearch()
+        while self._matches and not (self._starts and self._starts[-1] > position):
+            self.findMatches(1000)
+    
+    def slotSearchTimeout(self):
+        """Called by the search timer, finds the next batch of matches."""
+        self.findMatches(1000)
+    
+    def slotDocumentChanged(self, position, removed, added):
+        """Called when the document changes, the matches are found again."""
+        if self._changed is None or position < self._changed:
+            self._changed = position
+        if self.isVisible():
+            self._restartTimer.start()
+    
+    def slotUpdateRequest(self, rect, dy):
+        """Called when the view is scrolled or repainted."""
+        self.updateHighlighting()
+    
+    def updateCount(self):
+        """Shows the number of matches found (so far)."""
+        text = format(len(self._starts))
+        if self._matches:
+            text += "\u2026"
+        self.countLabel.setText(text)
+    
+    def updateHighlighting(self):
+        """Highlights the matches that are visible in the current view."""
+        view = self.currentView()
+        if not view or not self.isVisible():
+            return
+        rect = view.viewport().rect()
+        start = view.cursorForPosition(rect.topLeft()).block().position()
+        block = view.cursorForPosition(rect.bottomRight()).block()
+        end = block.position() + block.length()
+        first = bisect.bisect_right(self._ends, start)
+        last = bisect.bisect_left(self._starts, end)
+        if (first, last) != self._visible:
+            self._visible = (first, last)
+            cursors = [self.matchCursor(i) for i in range(first, last)]
+            viewhighlighter.highlighter(view).highlight("search", cursors, 1)
+    
+    def matchCursor(self, index):
+        """Returns a QTextCursor selecting the match, with its position at the start."""
+        cursor = QTextCursor(self.currentView().document())
+        cursor.setPosition(self._ends[index])
+        cursor.setPosition(self._starts[index], QTextCursor.KeepAnchor)
+        return cursor
         
     def findNext(self):
         view = self.currentView()
-        if view and self._positions:
-            positions = [c.position() for c in self._positions]
-            index = bisect.bisect_right(positions, view.textCursor().position())
-            if index < len(positions):
-                view.setTextCursor(self._positions[index])
-            else:
-                view.setTextCursor(self._positions[0])
-            view.ensureCursorVisible()
+        if view:
+            position = view.textCursor().position()
+            self.findMatchesUntil(position)
+            if self._starts:
+                index = bisect.bisect_right(self._starts, position)
+                if index >= len(self._starts):
+                    index = 0
+                view.setTextCursor(self.matchCursor(index))
+                view.ensureCursorVisible()
 
     def findPrevious(self):
+        self._wrapPrevious = False
         view = self.currentView()
-        positions = [c.position() for c in self._positions]
-        if view and positions:
-            index = bisect.bisect_left(positions, view.textCursor().position()) - 1
-            view.setTextCursor(self._positions[index])
-            view.ensureCursorVisible()
+        if view:
+            position = view.textCursor().position()
+            self.findMatchesUntil(position)
+            index = bisect.bisect_left(self._starts, position) - 1
+            if index < 0:
+                if self._matches:
+                    # wrap around when the background search has found the last match
+                    self._wrapPrevious = True
+                    return
+                index = len(self._starts) - 1
+            if self._starts:
+                view.setTextCursor(self.matchCursor(index))
+                view.ensureCursorVisible()
 
     def keyPressEvent(self, ev):
         if ev.key() == Qt.Key_Tab:
@@ -245,7 +371,7 @@ class Search(QWidget, plugin.MainWindowPlugin):
             self.window().focusNextChild()
             return
         # if in search mode, Up and Down jump between search results
-        if not self._replace and self._positions and self.searchEntry.text() and not ev.modifiers():
+        if not self._replace and self.searchEntry.text() and not ev.modifiers():
             if ev.key() == Qt.Key_Up:
                 self.findPrevious()
                 return
@@ -280,32 +406,38 @@ class Search(QWidget, plugin.MainWindowPlugin):
         
     def slotReplace(self):
         view = self.currentView()
-        if view and self._positions:
-            positions = [c.position() for c in self._positions]
-            index = bisect.bisect_left(positions, view.textCursor().position())
-            if index >= len(positions):
+        if view:
+            position = view.textCursor().position()
+            self.findMatchesUntil(position)
+            if not self._starts:
+                return
+            index = bisect.bisect_left(self._starts, position)
+            if index >= len(self._starts):
                 index = 0
-            if self.doReplace(self._positions[index]):
-                viewhighlighter.highlighter(view).highlight("search", self._positions, 1)
-                if index < len(positions) - 1:
-                    view.setTextCursor(self._positions[index+1])
-                else:
-                    view.setTextCursor(self._positions[0])
+            cursor = self.matchCursor(index)
+            if self.doReplace(cursor):
+                # the document has changed, find the matches after the replacement
+                position = cursor.selectionEnd()
+                self.findMatchesUntil(position)
+                if self._starts:
+                    index = bisect.bisect_left(self._starts, position)
+                    if index >= len(self._starts):
+                        index = 0
+                    view.setTextCursor(self.matchCursor(index))
                 view.ensureCursorVisible()
     
     def slotReplaceAll(self):
         view = self.currentView()
         if view:
-            replaced = False
-            cursors = self._positions
-            if view.textCursor().hasSelection():
-                cursors = [cursor for cursor in cursors if cursortools.contains(view.textCursor(), cursor)]
+            self.findMatches()
+            first, last = 0, len(self._starts)
+            selection = view.textCursor()
+            if selection.hasSelection():
+                first = bisect.bisect_left(self._starts, selection.selectionStart())
+                last = bisect.bisect_right(self._ends, selection.selectionEnd())
+            cursors = [self.matchCursor(i) for i in range(first, last)]
             view.textCursor().beginEditBlock()
             for cursor in cursors:
-                if self.doReplace(cursor):
-                    replaced = True
+                self.doReplace(cursor)
             view.textCursor().endEditBlock()
-            if replaced:
-                viewhighlighter.highlighter(view).highlight("search", self._positions, 1)
-
 
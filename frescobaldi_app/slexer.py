@@ -41,6 +41,11 @@ also test for the type of the token (e.g. if isinstance(token, Number)...).
 The tokens also carry a 'pos' and an 'end' attribute, specifying their position
 in the parsed text string.
 
+Using tokens(text, compact=True) the text is parsed at once, and a TokenStream
+is returned that stores the class, position and end of every token in compact
+arrays. Token instances are then only created when they are requested, and
+for Token classes that do not change the state, not even during parsing.
+
 A token may cause a different Parser to be enterend, of the current Parser to be
 left, etc. This is done by implementing the update_state() method of the Token
 subclass. This method is called automatically when the Token is instantiated.
@@ -124,9 +129,11 @@ del sys
 
 
 import re
+from array import array
 
 
-__all__ = ['Token', 'Parser', 'FallthroughParser', 'State', 'Fridge']
+__all__ = ['Token', 'Parser', 'FallthroughParser', 'State', 'Fridge',
+           'TokenStream']
 
 
 class State(object):
@@ -154,7 +161,7 @@ class State(object):
         """Return all active parsers, the most current one first."""
         return self.state[::-1]
     
-    def tokens(self, text, pos=0):
+    def tokens(self, text, pos=0, compact=False):
         """Parse a text string using our state info.
         
         Yields Token instances. All tokens are a subclass of str (or unicode in
@@ -163,7 +170,16 @@ class State(object):
         'default' class attribute, it is the Token subclass to use for pieces of
         text that would otherwise be skipped.
         
+        If compact is True, the whole text is parsed immediately and a
+        TokenStream is returned.
+        
         """
+        if compact:
+            return self._compact_tokens(text, pos)
+        return self._tokens(text, pos)
+    
+    def _tokens(self, text, pos):
+        """(Internal) Implementation of tokens(), yielding Token instances."""
         while True:
             parser = self.parser()
             m = parser.parse(text, pos)
@@ -183,6 +199,31 @@ class State(object):
             token.update_state(self)
             yield token
     
+    def _compact_tokens(self, text, pos):
+        """(Internal) Implementation of tokens() returning a TokenStream."""
+        stream = TokenStream(text)
+        ids, starts, ends = stream._ids, stream._pos, stream._end
+        def add(cls, pos, end):
+            # only instantiate the token if it can change the state
+            if not (_plain(cls) and _plain(type(self.state[-1]))):
+                cls(text[pos:end], pos).update_state(self)
+            ids.append(class_id(cls))
+            starts.append(pos)
+            ends.append(end)
+        while True:
+            parser = self.parser()
+            m = parser.parse(text, pos)
+            if m:
+                if parser.default and pos < m.start():
+                    add(parser.default, pos, m.start())
+                add(parser.token_class(m), m.start(), m.end())
+                pos = m.end()
+            elif pos == len(text) or parser.fallthrough(self):
+                break
+        if parser.default and pos < len(text):
+            add(parser.default, pos, len(text))
+        return stream
+    
     def enter(self, parser):
         """Enter a new parser.
         
@@ -397,11 +438,15 @@ class Parser(object):
         The match object is returned by the parse() method.
         
         """
+        return self.token_class(match)(match.group(), match.start())
+    
+    def token_class(self, match):
+        """Return the Token class to instantiate for the match object."""
         clss = self.index[match.lastindex]
         for c in clss[:-1]:
             if c.test_match(match):
-                return c(match.group(), match.start())
-        return clss[-1](match.group(), match.start())
+                return c
+        return clss[-1]
     
     def _follow(self, token, state):
         """(Internal) Called by State.follow(). Does nothing."""
@@ -474,18 +519,33 @@ class FallthroughParser(Parser):
 
 
 class Fridge(object):
-    """Stores frozen States under an integer number."""
+    """Stores frozen States under an integer number.
+    
+    Besides the list of frozen states, a dictionary maps every frozen state to
+    its number, so that freezing a state is a constant time operation, no
+    matter how many different states have been stored.
+    
+    """
     def __init__(self, stateClass = State):
         self._stateClass = stateClass
         self._states = []
+        self._index = {}
     
     def freeze(self, state):
         """Stores a state and return an identifying integer."""
-        frozen = state.freeze()
+        return self.store(state.freeze())
+
+    def store(self, frozen):
+        """Stores an already frozen state and return an identifying integer.
+        
+        The frozen argument is the tuple returned by State.freeze(), which may
+        e.g. have been created in a different thread.
+        
+        """
         try:
-            return self._states.index(frozen)
-        except ValueError:
-            i = len(self._states)
+            return self._index[frozen]
+        except KeyError:
+            i = self._index[frozen] = len(self._states)
             self._states.append(frozen)
             return i
 
@@ -498,6 +558,98 @@ class Fridge(object):
         """Returns the number of stored frozen states."""
         return len(self._states)
 
+    def clear(self):
+        """Forgets all stored states.
+        
+        All previously returned numbers become invalid.
+        
+        """
+        del self._states[:]
+        self._index.clear()
+
+    def compact(self, nums):
+        """Keeps only the states stored under the numbers in nums.
+        
+        Use this in long editing sessions to drop states that are not referred
+        to anymore. The remaining states are renumbered, keeping their relative
+        order. Returns a dictionary mapping the old numbers to the new ones, so
+        the caller can update the numbers it has stored. Numbers that are out
+        of range are ignored.
+        
+        """
+        keep = sorted(set(num for num in nums if 0 <= num < len(self._states)))
+        states = [self._states[num] for num in keep]
+        self._states[:] = states
+        self._index = dict((frozen, i) for i, frozen in enumerate(states))
+        return dict((num, i) for i, num in enumerate(keep))
+
+
+class TokenStream(object):
+    """A compact, array-backed sequence of the tokens in a text.
+    
+    For every token the class id (see class_id()), the position and the end
+    are stored. Token instances are created when they are requested by
+    indexing or iterating; use the cls(), pos() and end() methods to scan the
+    tokens without creating them.
+    
+    """
+    def __init__(self, text):
+        self.text = text
+        self._ids = array(str('H'))
+        self._pos = array(str('i'))
+        self._end = array(str('i'))
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def __getitem__(self, index):
+        """Return a Token instance (or a list of them if index is a slice)."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        pos, end = self._pos[index], self._end[index]
+        return _classes[self._ids[index]](self.text[pos:end], pos)
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def cls(self, index):
+        """Return the Token class of the token at index."""
+        return _classes[self._ids[index]]
+    
+    def pos(self, index):
+        """Return the position of the token at index."""
+        return self._pos[index]
+    
+    def end(self, index):
+        """Return the end position of the token at index."""
+        return self._end[index]
+
+
+_classes = []
+_class_ids = {}
+
+def class_id(cls):
+    """Return an integer uniquely identifying the Token class."""
+    try:
+        return _class_ids[cls]
+    except KeyError:
+        i = _class_ids[cls] = len(_classes)
+        _classes.append(cls)
+        return i
+
+
+_plain_classes = {}
+
+def _plain(cls):
+    """(Internal) Return True if the Token or Parser class has the default update_state()."""
+    try:
+        return _plain_classes[cls]
+    except KeyError:
+        base = Token if issubclass(cls, Token) else Parser
+        result = _plain_classes[cls] = cls.update_state == base.update_state
+        return result
+
 
 def uniq(iterable):
     """Yields unique items from iterable."""
@@ -551,6 +703,13 @@ if __name__ == "__main__":
         'en 2 of 3 nummers'):
         print(t.__class__, t)
 
+    print('test a compact TokenStream:')
+    s = State(PTest)
+    stream = s.tokens('een "tekst" met 2 woorden', compact=True)
+    for i in range(len(stream)):
+        print(stream.cls(i), stream.pos(i), stream.end(i))
+    assert list(stream) == list(State(PTest).tokens('een "tekst" met 2 woorden'))
+
     print('test the Fridge:')
     s = State(PTest)
     f = Fridge()
@@ -559,6 +718,7 @@ if __name__ == "__main__":
         print(t.__class__, t)
     
     n = f.freeze(s)
+    assert f.freeze(s) == n
     
     # recover
     print('freeze and recover:')
@@ -43,20 +43,25 @@ import highlighter
 def tokens(block):
     """Returns the tokens for the given block as a (possibly empty) tuple."""
     try:
-        return block.userData().tokens
+        data = block.userData()
+        tokens = data.tokens
     except AttributeError:
         # we used to call highlighter.highlighter(block.document()).rehighlight()
         # here, but there is a bug in PyQt-4.9.6 causing QTextBlockUserData to
         # lose its Python attributes. So we only run the highlighter when the
         # previous block's userState() is -1.
         return tuple(state(block).tokens(block.text()))
+    if not isinstance(tokens, tuple):
+        # the highlighter stores a compact TokenStream, create the Tokens once
+        tokens = data.tokens = tuple(tokens)
+    return tokens
 
 
 def state(block):
     """Return the ly.lex.State() object at the beginning of the given QTextBlock."""
     hl = highlighter.highlighter(block.document())
     if block.previous().userState() == -1 and block.blockNumber() > 0:
-        hl.rehighlight()
+        hl.highlightUpTo(block.previous())
     return hl.state(block.previous())
 
 
@@ -64,7 +69,7 @@ def state_end(block):
     """Return the ly.lex.State() object at the end of the given QTextBlock."""
     hl = highlighter.highlighter(block.document())
     if block.userState() == -1:
-        hl.rehighlight()
+        hl.highlightUpTo(block)
     return hl.state(block)
 
 
@@ -44,6 +44,7 @@ app.viewCreated.connect(highlighter)
 class ViewHighlighter(widgets.arbitraryhighlighter.ArbitraryHighlighter, plugin.Plugin):
     def __init__(self, view):
         super(ViewHighlighter, self).__init__(view)
+        self.setClipping("search")
         self._cursorFormat = QTextCharFormat()
         self._cursorFormat.setProperty(QTextFormat.FullWidthSelection, True)
         app.settingsChanged.connect(self.readSettings)
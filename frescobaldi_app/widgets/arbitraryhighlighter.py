@@ -20,8 +20,15 @@
 """
 Manages highlighting of arbitrary sections in a Q(Plain)TextEdit
 using QTextEdit.ExtraSelections.
+
+The selections are kept per format, in layers ordered by priority.
+Optionally, for formats with many selections that do not overlap (e.g.
+search results), only the selections in the visible part of a
+QPlainTextEdit are given to it.
 """
 
+import bisect
+import itertools
 import weakref
 
 from PyQt4.QtCore import QObject, QTimer
@@ -37,7 +44,13 @@ class ArbitraryHighlighter(QObject):
     def __init__(self, edit):
         """Initializes ourselves with a Q(Plain)TextEdit as parent."""
         super(ArbitraryHighlighter, self).__init__(edit)
-        self._selections = {}
+        self._selections = {}   # format: (priority, selections[, timer])
+        self._layers = []       # sorted list of (priority, serial, format)
+        self._serial = itertools.count()
+        self._clipped = set()   # formats of which only visible selections are shown
+        self._range = None      # visible (start, end) positions when clipping
+        self._visible = {}      # format: the selections in the visible range
+        self._dirty = set()     # clipped formats whose visible selections are outdated
     
     def highlight(self, format, cursors, priority=0, msec=0):
         """Highlights the selection of an arbitrary list of QTextCursors.
@@ -56,6 +69,12 @@ class ArbitraryHighlighter(QObject):
             es.cursor = cursor
             es.format = fmt
             selections.append(es)
+        selections.sort(key=lambda es: es.cursor.selectionStart())
+        old = self._selections.get(format)
+        if not old or old[0] != priority:
+            if old:
+                self._removeLayer(format)
+            bisect.insort(self._layers, (priority, next(self._serial), format))
         if msec:
             def clear(selfref=weakref.ref(self)):
                 self = selfref()
@@ -66,7 +85,7 @@ class ArbitraryHighlighter(QObject):
             self._selections[format] = (priority, selections, timer)
         else:
             self._selections[format] = (priority, selections)
-        self.update()
+        self.update(format)
 
     def clear(self, format):
         """Removes the highlighting for the given format (name or QTextCharFormat)."""
@@ -75,18 +94,53 @@ class ArbitraryHighlighter(QObject):
         except KeyError:
             pass
         else:
+            self._removeLayer(format)
+            self._visible.pop(format, None)
+            self._dirty.discard(format)
             self.update()
 
     def textFormat(self, name):
         """Implement this to return a QTextCharFormat for the given name."""
         raise NotImplementedError
 
-    def update(self):
-        """(Internal) Called whenever the arbitrary highlighting changes."""
+    def setClipping(self, format, enabled=True):
+        """Gives only the visible selections of the format to the text edit.
+        
+        This only works if the text edit is a QPlainTextEdit. The selections
+        of the format should not overlap each other, e.g. search results.
+        
+        """
+        if enabled == (format in self._clipped):
+            return
         textedit = self.parent()
-        if textedit:
-            textedit.setExtraSelections(
-                sum((s[1] for s in sorted(self._selections.values())), []))
+        if enabled:
+            if not self._clipped:
+                textedit.updateRequest.connect(self._updateRequest)
+                self._range = None
+            self._clipped.add(format)
+        else:
+            self._clipped.discard(format)
+            self._visible.pop(format, None)
+            if not self._clipped:
+                textedit.updateRequest.disconnect(self._updateRequest)
+        self.update(format)
+
+    def clipping(self, format):
+        """Returns True if only the visible selections of the format are shown."""
+        return format in self._clipped
+
+    def update(self, format=None):
+        """(Internal) Called whenever the arbitrary highlighting changes.
+        
+        If format is given, only the highlighting for that format has changed.
+        The text edit is updated immediately.
+        
+        """
+        if format is None:
+            self._dirty.update(self._clipped)
+        elif format in self._clipped:
+            self._dirty.add(format)
+        self._update()
 
     def reload(self):
         """Reloads the named formats in the highlighting (e.g. in case of settings change)."""
@@ -97,4 +151,69 @@ class ArbitraryHighlighter(QObject):
                     es.format = fmt
         self.update()
 
+    def _removeLayer(self, format):
+        """(Internal) Removes the format from the ordered list of layers."""
+        for i, layer in enumerate(self._layers):
+            if layer[2] == format:
+                del self._layers[i]
+                return
+
+    def _update(self):
+        """(Internal) Gives the selections of all layers to the text edit."""
+        textedit = self.parent()
+        if not textedit:
+            return
+        dirty = self._dirty.intersection(self._selections)
+        self._dirty.clear()
+        if dirty:
+            if self._range is None:
+                self._range = self._visibleRange()
+            start, end = self._range
+            for format in dirty:
+                self._visible[format] = _clip(self._selections[format][1], start, end)
+        layers = (self._visible[format] if format in self._clipped
+                  else self._selections[format][1]
+                  for p, s, format in self._layers)
+        textedit.setExtraSelections(list(itertools.chain.from_iterable(layers)))
+
+    def _updateRequest(self, rect, dy):
+        """(Internal) Called when the text edit is scrolled or repainted."""
+        visible = self._visibleRange()
+        if visible != self._range:
+            self._range = visible
+            self._dirty.update(self._clipped)
+            if self._dirty.intersection(self._selections):
+                self._update()
+
+    def _visibleRange(self):
+        """(Internal) Returns the (start, end) positions of the visible blocks."""
+        textedit = self.parent()
+        rect = textedit.viewport().rect()
+        start = textedit.cursorForPosition(rect.topLeft()).block().position()
+        block = textedit.cursorForPosition(rect.bottomRight()).block()
+        return start, block.position() + block.length()
+
+
+def _clip(selections, start, end):
+    """(Internal) Returns the selections touching the range start - end.
+    
+    The selections must be sorted and may not overlap, so that both their
+    starts and ends are in order; two binary searches find the range.
+    
+    """
+    lo, hi = 0, len(selections)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if selections[mid].cursor.selectionEnd() < start:
+            lo = mid + 1
+        else:
+            hi = mid
+    first, hi = lo, len(selections)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if selections[mid].cursor.selectionStart() <= end:
+            lo = mid + 1
+        else:
+            hi = mid
+    return selections[first:lo]
 